@@ -1,10 +1,17 @@
+import argparse
+import asyncio
 import logging
+import multiprocessing
 import os
 import typing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from pathlib import Path
 
-from advanced_alchemy.base import orm_registry
+from cachetools import LRUCache
 from fluent_compiler.bundle import FluentBundle
-from redis.asyncio import ConnectionPool
+from redis.asyncio import ConnectionPool, Redis
 from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from telegram import BotCommand
 from telegram.constants import ParseMode
@@ -15,20 +22,54 @@ from telegram.ext import (
     Defaults,
 )
 
-from travel_agent import handlers
-from travel_agent.constants import LOCALES_DIR
+from travel_agent import handlers, migrations
+from travel_agent.cache import TwoTierCache, VersionedCache
+from travel_agent.constants import LOCALES_DIR, USER_AGENT
 from travel_agent.context import Context
+from travel_agent.geocoding import Geocoder, locate_home
 from travel_agent.handlers.start import start
+from travel_agent.http_client import create_http_client, get_pool_stats
 from travel_agent.l10n import Localization
+from travel_agent.notifications import NotificationDispatcher
+from travel_agent.persistence import RedisPersistence, create_refresh_handler
+from travel_agent.rate_limit import RateLimiter, RedisThrottle
+from travel_agent.rendering import (
+    ImageEncoding,
+    MapRenderer,
+    TileSource,
+    is_osm_tile_server,
+    warm_up,
+)
+from travel_agent.repositories import (
+    LocationRepository,
+    MapSearchRepository,
+    UserRepository,
+    dump_places,
+    dump_profile,
+    dump_travel_header,
+    load_places,
+    load_profile,
+    load_travel_header,
+)
+from travel_agent.tile_cache import TileCache
+from travel_agent.update_processor import PerUserUpdateProcessor
 
 if typing.TYPE_CHECKING:
+    import httpx
     from sqlalchemy.ext.asyncio import AsyncEngine
 
+logger = logging.getLogger(__name__)
+
 
 async def post_init(application: Application) -> None:
     engine: AsyncEngine = application.bot_data["db_engine"]
-    async with engine.begin() as connection:
-        await connection.run_sync(orm_registry.metadata.create_all)
+    head = migrations.get_head_revision()
+    # Workers starting together wait for the first one to migrate.
+    if await migrations.get_current_revision(engine) != head:
+        logger.info("Migrating the database schema to %s", head)
+        await migrations.upgrade(engine)
+
+    application.bot_data["notifications"].start()
 
     await application.bot.set_my_commands(
         (
@@ -41,31 +82,251 @@ async def post_init(application: Application) -> None:
     )
 
 
-def main() -> None:
-    logging.basicConfig(level=logging.INFO)
-    logging.getLogger("httpx").setLevel(logging.WARNING)
+async def post_stop(application: Application) -> None:
+    # The bot can't send messages after the application is shut down.
+    notifications: NotificationDispatcher = application.bot_data["notifications"]
+    await notifications.stop(
+        grace_period=float(os.getenv("NOTIFICATIONS_GRACE_PERIOD", "10"))
+    )
+    logger.info("Notifications: %s", notifications.stats)
+    rate_limiter: RateLimiter = application.bot.rate_limiter
+    logger.info(
+        "Rate limiter: %s, average wait %.3fs",
+        rate_limiter.stats,
+        rate_limiter.stats.average_wait_time,
+    )
+
+
+async def post_shutdown(application: Application) -> None:
+    httpx_client: httpx.AsyncClient = application.bot_data["httpx_client"]
+    for host, stats in get_pool_stats(httpx_client).items():
+        logger.info("HTTP pool %s: %s", host, stats)
+    await httpx_client.aclose()
+
+    map_renderer: MapRenderer = application.bot_data["map_renderer"]
+    map_renderer.executor.shutdown()
+
+    logger.info("Resources used by updates: %s", application.bot_data["resource_usage"])
+
+    geocoder: Geocoder = application.bot_data["geocoder"]
+    logger.info("Geocoding cache: %s", geocoder.cache.stats)
+    logger.info("Geocoder: %s", geocoder.stats)
+    profile_cache: VersionedCache = application.bot_data["profile_cache"]
+    logger.info("Profile cache: %s", profile_cache.cache.stats)
+    travel_header_cache: VersionedCache = application.bot_data["travel_header_cache"]
+    logger.info("Travel header cache: %s", travel_header_cache.cache.stats)
+
+    redis_pool: ConnectionPool = application.bot_data["redis_pool"]
+    await redis_pool.aclose()
+
+
+def create_http_client_from_env() -> "httpx.AsyncClient":
+    return create_http_client(
+        max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", "100")),
+        max_keepalive_connections=int(
+            os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20")
+        ),
+        keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30")),
+        timeout=float(os.getenv("HTTP_TIMEOUT", "10")),
+        connect_timeout=float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+        http2=os.getenv("HTTP2", "1") == "1",
+    )
+
+
+def get_tile_url_template() -> str:
+    return os.getenv(
+        "TILE_URL_TEMPLATE", "https://a.tile.openstreetmap.org/{z}/{x}/{y}.png"
+    )
+
+
+def create_tile_source_from_env(httpx_client: "httpx.AsyncClient") -> TileSource:
+    return TileSource(
+        client=httpx_client,
+        cache=TileCache(
+            path=Path(os.getenv("TILE_CACHE_PATH", "tiles.sqlite3")),
+            max_size=int(os.getenv("TILE_CACHE_MAX_SIZE", str(512 * 2**20))),
+        ),
+        url_template=get_tile_url_template(),
+        user_agent=USER_AGENT,
+        max_downloads=int(os.getenv("TILE_MAX_DOWNLOADS", "2")),
+    )
+
+
+def create_geocoder_from_env(
+    httpx_client: "httpx.AsyncClient", redis_pool: ConnectionPool
+) -> Geocoder:
+    # The public Nominatim instance allows one request per second, shared by
+    # all workers behind the same IP.
+    min_interval = float(os.getenv("GEOCODER_MIN_INTERVAL", "1"))
+    return Geocoder(
+        httpx_client,
+        TwoTierCache(
+            Redis(connection_pool=redis_pool),
+            namespace="geocode",
+            maxsize=int(os.getenv("GEOCODING_CACHE_SIZE", "4096")),
+            ttl=timedelta(seconds=int(os.getenv("GEOCODING_CACHE_TTL", "604800"))),
+            negative_ttl=timedelta(
+                seconds=int(os.getenv("GEOCODING_CACHE_NEGATIVE_TTL", "3600"))
+            ),
+            dumps=dump_places,
+            loads=load_places,
+        ),
+        url=os.getenv("GEOCODER_URL", "https://nominatim.openstreetmap.org/search"),
+        user_agent=USER_AGENT,
+        throttle=RedisThrottle(
+            Redis(connection_pool=redis_pool), "geocode:throttle", min_interval
+        )
+        if min_interval > 0
+        else None,
+    )
+
+
+async def migrate() -> None:
+    engine = create_async_engine(os.getenv("DB_URL"))
+    await migrations.upgrade(engine)
+    await engine.dispose()
+
+
+async def warm_tiles(zoom_levels: int) -> None:
+    engine = create_async_engine(os.getenv("DB_URL"))
+    async with async_sessionmaker(engine)() as session:
+        bounds = await LocationRepository(session=session).get_travel_bounds()
+    await engine.dispose()
+
+    async with create_http_client_from_env() as httpx_client:
+        count = await warm_up(
+            create_tile_source_from_env(httpx_client), bounds, zoom_levels
+        )
+    logger.info("Prefetched %d viewports for %d travels", count, len(bounds))
+
+
+async def locate_homes() -> None:
+    engine = create_async_engine(os.getenv("DB_URL"))
+    redis_pool = ConnectionPool.from_url(os.getenv("REDIS_URL"))
+    async with (
+        create_http_client_from_env() as httpx_client,
+        # Users are updated one by one, the rest must stay loaded.
+        async_sessionmaker(engine, expire_on_commit=False)() as session,
+    ):
+        map_search = MapSearchRepository(
+            create_geocoder_from_env(httpx_client, redis_pool)
+        )
+        user_repo = UserRepository(session=session, auto_commit=True)
+        users = await user_repo.list_without_home()
+        located = 0
+        for user in users:
+            place = await locate_home(map_search, user.country, user.city)
+            if place is not None:
+                user.home_lat, user.home_lon = place.lat, place.lon
+                await user_repo.update(user)
+                located += 1
+    await redis_pool.aclose()
+    await engine.dispose()
+    logger.info("Located homes of %d out of %d users", located, len(users))
+
 
+def run_bot() -> None:
+    # Can point to a local Bot API server.
+    api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+    redis_pool = ConnectionPool.from_url(os.getenv("REDIS_URL"))
+    persistence = RedisPersistence(
+        redis_pool,
+        ttl=timedelta(seconds=int(os.getenv("PERSISTENCE_TTL", "86400"))),
+        update_interval=float(os.getenv("PERSISTENCE_UPDATE_INTERVAL", "1")),
+    )
     application = (
         Application.builder()
         .token(os.getenv("TELEGRAM_TOKEN"))
+        .base_url(f"{api_url}/bot")
+        .base_file_url(f"{api_url}/file/bot")
+        .concurrent_updates(
+            PerUserUpdateProcessor(int(os.getenv("CONCURRENT_UPDATES", "64")))
+        )
+        .persistence(persistence)
+        .rate_limiter(
+            RateLimiter(
+                global_rate=float(os.getenv("TELEGRAM_GLOBAL_RATE", "25")),
+                chat_rate=float(os.getenv("TELEGRAM_CHAT_RATE", "1")),
+                chat_burst=int(os.getenv("TELEGRAM_CHAT_BURST", "3")),
+                group_rate=float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60))),
+            )
+        )
         .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
         .context_types(ContextTypes(Context))
         .defaults(Defaults(parse_mode=ParseMode.HTML))
-        .arbitrary_callback_data(True)  # noqa: FBT003
         .build()
     )
 
+    application.bot_data["resource_usage"] = Counter()
+    # IDs of users that are known to exist in the database.
+    application.bot_data["known_users"] = LRUCache(
+        maxsize=int(os.getenv("KNOWN_USERS_CACHE_SIZE", "100000"))
+    )
+
     application.bot_data["db_engine"] = create_async_engine(os.getenv("DB_URL"))
     application.bot_data["db_session_factory"] = async_sessionmaker(
         application.bot_data["db_engine"]
     )
 
-    application.bot_data["redis_pool"] = ConnectionPool.from_url(os.getenv("REDIS_URL"))
+    application.bot_data["redis_pool"] = redis_pool
+
+    entity_cache_ttl = timedelta(seconds=int(os.getenv("ENTITY_CACHE_TTL", "3600")))
+    application.bot_data["profile_cache"] = VersionedCache(
+        TwoTierCache(
+            Redis(connection_pool=redis_pool),
+            namespace="profile",
+            maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "1024")),
+            ttl=entity_cache_ttl,
+            negative_ttl=entity_cache_ttl,
+            dumps=dump_profile,
+            loads=load_profile,
+            is_negative=lambda _: False,
+        )
+    )
+    application.bot_data["travel_header_cache"] = VersionedCache(
+        TwoTierCache(
+            Redis(connection_pool=redis_pool),
+            namespace="travel_header",
+            maxsize=int(os.getenv("TRAVEL_CACHE_SIZE", "1024")),
+            ttl=entity_cache_ttl,
+            negative_ttl=entity_cache_ttl,
+            dumps=dump_travel_header,
+            loads=load_travel_header,
+            is_negative=lambda _: False,
+        )
+    )
+
+    application.bot_data["notifications"] = NotificationDispatcher(
+        application.bot, workers=int(os.getenv("NOTIFICATION_WORKERS", "8"))
+    )
+
+    httpx_client = create_http_client_from_env()
+    application.bot_data["httpx_client"] = httpx_client
+
+    application.bot_data["geocoder"] = create_geocoder_from_env(
+        httpx_client, redis_pool
+    )
+
+    application.bot_data["map_renderer"] = MapRenderer(
+        tiles=create_tile_source_from_env(httpx_client),
+        executor=ProcessPoolExecutor(
+            max_workers=int(os.getenv("MAP_RENDER_WORKERS", "2")),
+            mp_context=multiprocessing.get_context("spawn"),
+        ),
+        encoding=ImageEncoding(
+            image_format=os.getenv("MAP_IMAGE_FORMAT", "png"),
+            quality=int(os.getenv("MAP_IMAGE_QUALITY", "85")),
+            optimize=os.getenv("MAP_IMAGE_OPTIMIZE", "1") == "1",
+        ),
+    )
 
     application.bot_data["l10n"] = Localization(
         FluentBundle.from_files("ru", [LOCALES_DIR / "ru.ftl"])
     )
 
+    application.add_handler(create_refresh_handler(persistence), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handlers(handlers.help.create_handlers())
     application.add_handlers(handlers.settings.create_handlers())
@@ -74,7 +335,53 @@ def main() -> None:
     application.add_handlers(handlers.locations.create_handlers())
     application.add_handlers(handlers.routes.create_handlers())
 
-    application.run_polling()
+    webhook_url = os.getenv("WEBHOOK_URL")
+    if webhook_url:
+        application.run_webhook(
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),  # noqa: S104
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            url_path=os.getenv("WEBHOOK_PATH", ""),
+            webhook_url=webhook_url,
+            secret_token=os.getenv("WEBHOOK_SECRET_TOKEN"),
+        )
+    else:
+        application.run_polling()
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(prog="travel_agent")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("migrate", help="apply pending schema migrations")
+    warm_tiles_parser = subparsers.add_parser(
+        "warm-tiles", help="prefetch map tiles around locations of travels"
+    )
+    warm_tiles_parser.add_argument(
+        "--zoom-levels",
+        type=int,
+        default=2,
+        help="how many zoom levels to prefetch, starting from the fitting one",
+    )
+    subparsers.add_parser(
+        "locate-homes", help="geocode homes of users who set them before"
+    )
+    args = parser.parse_args()
+
+    if args.command == "migrate":
+        asyncio.run(migrate())
+    elif args.command == "warm-tiles":
+        if is_osm_tile_server(get_tile_url_template()):
+            parser.error(
+                "bulk prefetching from tile.openstreetmap.org is forbidden, "
+                "set TILE_URL_TEMPLATE to your own tile server"
+            )
+        asyncio.run(warm_tiles(args.zoom_levels))
+    elif args.command == "locate-homes":
+        asyncio.run(locate_homes())
+    else:
+        run_bot()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,132 @@
+import typing
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Generic, TypeVar
+
+from cachetools import TLRUCache
+from redis.asyncio import Redis
+
+T = TypeVar("T")
+
+
+@dataclass
+class CacheStats:
+    local_hits: int = 0
+    redis_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hits(self: typing.Self) -> int:
+        return self.local_hits + self.redis_hits
+
+    @property
+    def hit_ratio(self: typing.Self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TwoTierCache(Generic[T]):
+    """In-process TTL LRU in front of Redis.
+
+    Values for which `is_negative` is true (e.g. empty search results) are
+    kept for `negative_ttl` instead of `ttl`.
+    """
+
+    def __init__(  # noqa: PLR0913
+        self: typing.Self,
+        client: Redis,
+        *,
+        namespace: str,
+        maxsize: int,
+        ttl: timedelta,
+        negative_ttl: timedelta,
+        dumps: Callable[[T], bytes],
+        loads: Callable[[bytes], T],
+        is_negative: Callable[[T], bool] = lambda value: not value,
+    ) -> None:
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.dumps = dumps
+        self.loads = loads
+        self.is_negative = is_negative
+        self.stats = CacheStats()
+        self._local: TLRUCache[str, T] = TLRUCache(maxsize=maxsize, ttu=self._ttu)
+
+    def _ttu(self: typing.Self, _key: str, value: T, now: float) -> float:
+        return now + self._ttl_for(value).total_seconds()
+
+    def _ttl_for(self: typing.Self, value: T) -> timedelta:
+        return self.negative_ttl if self.is_negative(value) else self.ttl
+
+    def _redis_key(self: typing.Self, key: str) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self: typing.Self, key: str) -> T | None:
+        value = self._local.get(key)
+        if value is not None:
+            self.stats.local_hits += 1
+            return value
+
+        raw: bytes | None = await self.client.get(self._redis_key(key))
+        if raw is None:
+            self.stats.misses += 1
+            return None
+
+        self.stats.redis_hits += 1
+        value = self.loads(raw)
+        self._local[key] = value
+        return value
+
+    async def set(self: typing.Self, key: str, value: T) -> None:
+        self._local[key] = value
+        await self.client.set(
+            self._redis_key(key), self.dumps(value), ex=self._ttl_for(value)
+        )
+
+    async def delete(self: typing.Self, key: str) -> None:
+        self._local.pop(key, None)
+        await self.client.delete(self._redis_key(key))
+
+
+class VersionedCache(Generic[T]):
+    """`TwoTierCache` whose entries are invalidated by bumping their version.
+
+    The version of a key is kept in Redis and is part of the key of its
+    entry, so once the key is invalidated no worker reads an older entry,
+    not even from its local tier. Invalidate after the change is committed.
+
+    Every read or write of a version keeps it for twice the TTL of entries,
+    so it outlives the entries of its versions and doesn't start over from 0
+    while they can still be read.
+    """
+
+    def __init__(self: typing.Self, cache: TwoTierCache[T]) -> None:
+        self.cache = cache
+        self.version_ttl = 2 * max(cache.ttl, cache.negative_ttl)
+
+    def _version_key(self: typing.Self, key: str) -> str:
+        return f"{self.cache.namespace}:version:{key}"
+
+    async def get(self: typing.Self, key: str) -> tuple[T | None, int]:
+        """Value of the key, or None, and the version to set it with."""
+        raw: bytes | None = await self.cache.client.getex(
+            self._version_key(key), ex=self.version_ttl
+        )
+        version = 0 if raw is None else int(raw)
+        return await self.cache.get(f"{key}:{version}"), version
+
+    async def set(self: typing.Self, key: str, version: int, value: T) -> None:
+        await self.cache.set(f"{key}:{version}", value)
+
+    async def invalidate(self: typing.Self, key: str, value: T | None = None) -> None:
+        """Bump the version of the key and set its new value, if known."""
+        version_key = self._version_key(key)
+        async with self.cache.client.pipeline() as pipeline:
+            pipeline.incr(version_key)
+            pipeline.expire(version_key, self.version_ttl)
+            version, _ = await pipeline.execute()
+        if value is not None:
+            await self.set(key, version, value)
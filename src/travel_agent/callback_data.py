@@ -0,0 +1,89 @@
+"""Callback data of inline buttons.
+
+Callback data is an action and its arguments joined with ":", e.g.
+`travel:42`. Telegram limits it to 64 bytes, so larger arguments are put
+into `CallbackPayloadRepository` and referenced by their key.
+"""
+
+import typing
+from collections.abc import Callable
+
+from telegram import CallbackQuery, Update
+from telegram.ext import BaseHandler
+
+from travel_agent.context import Context
+from travel_agent.types import Callback
+
+SEPARATOR: typing.Final = ":"
+MAX_LENGTH: typing.Final = 64
+
+
+def pack(action: str, *args: int | str) -> str:
+    data = SEPARATOR.join((action, *map(str, args)))
+    if len(data.encode()) > MAX_LENGTH:
+        msg = f"callback data is longer than {MAX_LENGTH} bytes: {data!r}"
+        raise ValueError(msg)
+    return data
+
+
+def unpack(data: str) -> list[str]:
+    """Arguments of the action."""
+    return data.split(SEPARATOR)[1:]
+
+
+def get_action(data: object) -> str | None:
+    if not isinstance(data, str):
+        return None
+    return data.partition(SEPARATOR)[0]
+
+
+def has_action(action: str) -> Callable[[object], bool]:
+    """Pattern of a `CallbackQueryHandler` for one action."""
+    return lambda data: get_action(data) == action
+
+
+async def get_payload(
+    callback_query: CallbackQuery, context: Context, key: str
+) -> bytes | None:
+    """Payload of a button, or None after telling the user it has expired."""
+    payload = await context.callback_payload_repo.get(key)
+    if payload is None:
+        await callback_query.answer("Кнопка устарела, откройте меню заново.")
+    return payload
+
+
+async def get_travel_id(
+    callback_query: CallbackQuery, context: Context, arg: str
+) -> int | None:
+    """ID of a travel of the user, or None after telling them it isn't found.
+
+    Clients can send any callback data, so it isn't trusted.
+    """
+    travel_id = int(arg) if arg.isdecimal() else None
+    if travel_id is None or not await context.travel_repo.is_member(
+        travel_id, callback_query.from_user.id
+    ):
+        await callback_query.answer("Путешествие не найдено.")
+        return None
+    return travel_id
+
+
+class CallbackQueryDispatcher(BaseHandler[Update, Context]):
+    """Handles callback queries of several actions with a dict lookup."""
+
+    def __init__(self: typing.Self, callbacks: dict[str, Callback]) -> None:
+        super().__init__(self._dispatch)
+        self.callbacks = callbacks
+
+    def check_update(self: typing.Self, update: object) -> bool:
+        return (
+            isinstance(update, Update)
+            and update.callback_query is not None
+            and get_action(update.callback_query.data) in self.callbacks
+        )
+
+    async def _dispatch(
+        self: typing.Self, update: Update, context: Context
+    ) -> typing.Any:  # noqa: ANN401
+        action = get_action(update.callback_query.data)
+        return await self.callbacks[action](update, context)
@@ -2,3 +2,4 @@ from pathlib import Path
 from typing import Final
 
 LOCALES_DIR: Final = Path(__file__).parent / "locales"
+USER_AGENT: Final = "travel-agent/1.0 (+https://t.me/travel_agent_samylovma_bot)"
@@ -1,13 +1,21 @@
-from typing import TYPE_CHECKING, Any, Self
+from typing import TYPE_CHECKING, Self
 
+import httpx
 from fluent_compiler.bundle import FluentBundle
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession
 from telegram.ext import Application, CallbackContext
 
+from travel_agent.notifications import NotificationDispatcher
+from travel_agent.rendering import MapRenderer
 from travel_agent.repositories import (
+    CallbackPayloadRepository,
     InviteTokenRepository,
     LocationRepository,
     MapSearchRepository,
     NoteRepository,
+    RenderedMessageRepository,
+    RouteMapRepository,
     RouteRepository,
     TravelRepository,
     UserRepository,
@@ -25,10 +33,13 @@ class Context(CallbackContext):
         user_id: int | None = None,
     ) -> None:
         super().__init__(application=application, chat_id=chat_id, user_id=user_id)
-        self.data: dict[Any, Any] = {}
-
         self._user: User | None = None
 
+        # Names of resources acquired while handling the update, for metrics.
+        self.used_resources: set[str] = set()
+        self._db_session: AsyncSession | None = None
+        self._redis_client: Redis | None = None
+
         self._user_repo: UserRepository | None = None
         self._travel_repo: TravelRepository | None = None
         self._note_repo: NoteRepository | None = None
@@ -36,12 +47,43 @@ class Context(CallbackContext):
         self._invite_token_repository: InviteTokenRepository | None = None
         self._map_search_repo: MapSearchRepository | None = None
         self._route_repo: RouteRepository | None = None
+        self._route_map_repo: RouteMapRepository | None = None
+        self._callback_payload_repo: CallbackPayloadRepository | None = None
+        self._rendered_message_repo: RenderedMessageRepository | None = None
+
+    @property
+    def db_session(self: Self) -> AsyncSession:
+        if self._db_session is None:
+            self._db_session = self.bot_data["db_session_factory"]()
+            self.used_resources.add("db_session")
+        return self._db_session
+
+    @property
+    def redis_client(self: Self) -> Redis:
+        if self._redis_client is None:
+            self._redis_client = Redis(connection_pool=self.bot_data["redis_pool"])
+            self.used_resources.add("redis_client")
+        return self._redis_client
+
+    @property
+    def httpx_client(self: Self) -> httpx.AsyncClient:
+        self.used_resources.add("httpx_client")
+        return self.bot_data["httpx_client"]
+
+    async def close_resources(self: Self) -> None:
+        """Close only the resources that were acquired."""
+        if self._db_session is not None:
+            await self._db_session.close()
+        if self._redis_client is not None:
+            await self._redis_client.aclose()
 
     @property
     def user_repo(self: Self) -> UserRepository:
         if self._user_repo is None:
             self._user_repo = UserRepository(
-                session=self.data["db_session"], auto_commit=True
+                session=self.db_session,
+                auto_commit=True,
+                profile_cache=self.bot_data["profile_cache"],
             )
         return self._user_repo
 
@@ -49,23 +91,25 @@ class Context(CallbackContext):
     def travel_repo(self: Self) -> TravelRepository:
         if self._travel_repo is None:
             self._travel_repo = TravelRepository(
-                session=self.data["db_session"], auto_commit=True
+                session=self.db_session,
+                auto_commit=True,
+                header_cache=self.bot_data["travel_header_cache"],
             )
         return self._travel_repo
 
     @property
     def note_repo(self: Self) -> NoteRepository:
         if self._note_repo is None:
-            self._note_repo = NoteRepository(
-                session=self.data["db_session"], auto_commit=True
-            )
+            self._note_repo = NoteRepository(session=self.db_session, auto_commit=True)
         return self._note_repo
 
     @property
     def location_repo(self: Self) -> LocationRepository:
         if self._location_repo is None:
             self._location_repo = LocationRepository(
-                session=self.data["db_session"], auto_commit=True
+                session=self.db_session,
+                auto_commit=True,
+                travel_header_cache=self.bot_data["travel_header_cache"],
             )
         return self._location_repo
 
@@ -73,7 +117,7 @@ class Context(CallbackContext):
     def invite_token_repo(self: Self) -> InviteTokenRepository:
         if self._invite_token_repository is None:
             self._invite_token_repository = InviteTokenRepository(
-                client=self.data["redis_client"]
+                client=self.redis_client
             )
         return self._invite_token_repository
 
@@ -81,16 +125,48 @@ class Context(CallbackContext):
     def map_search_repo(self: Self) -> MapSearchRepository:
         if self._map_search_repo is None:
             self._map_search_repo = MapSearchRepository(
-                client=self.data["httpx_client"]
+                geocoder=self.bot_data["geocoder"]
             )
         return self._map_search_repo
 
     @property
     def route_repo(self: Self) -> RouteRepository:
         if self._route_repo is None:
-            self._route_repo = RouteRepository(client=self.data["httpx_client"])
+            self._route_repo = RouteRepository(
+                client=self.httpx_client, cache=self.redis_client
+            )
         return self._route_repo
 
+    @property
+    def route_map_repo(self: Self) -> RouteMapRepository:
+        if self._route_map_repo is None:
+            self._route_map_repo = RouteMapRepository(client=self.redis_client)
+        return self._route_map_repo
+
+    @property
+    def callback_payload_repo(self: Self) -> CallbackPayloadRepository:
+        if self._callback_payload_repo is None:
+            self._callback_payload_repo = CallbackPayloadRepository(
+                client=self.redis_client
+            )
+        return self._callback_payload_repo
+
+    @property
+    def rendered_message_repo(self: Self) -> RenderedMessageRepository:
+        if self._rendered_message_repo is None:
+            self._rendered_message_repo = RenderedMessageRepository(
+                client=self.redis_client
+            )
+        return self._rendered_message_repo
+
+    @property
+    def notifications(self: Self) -> NotificationDispatcher:
+        return self.bot_data["notifications"]
+
+    @property
+    def map_renderer(self: Self) -> MapRenderer:
+        return self.bot_data["map_renderer"]
+
     @property
     def l10n(self: Self) -> FluentBundle:
         return self.bot_data["l10n"]
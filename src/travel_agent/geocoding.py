@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import typing
+from collections import Counter
+
+import httpx
+from redis.exceptions import RedisError
+
+from travel_agent.cache import TwoTierCache
+from travel_agent.rate_limit import RedisThrottle
+from travel_agent.repositories import MapSearchRepository, Place
+
+# What a search can fail with: the geocoder or Redis being unavailable, or
+# a response of an unexpected shape.
+SEARCH_ERRORS: typing.Final = (
+    httpx.HTTPError,
+    RedisError,
+    KeyError,
+    TypeError,
+    ValueError,
+)
+
+
+class Geocoder:
+    """Searches places with Nominatim, or a compatible self-hosted geocoder.
+
+    Results are cached. Concurrent searches of the same query share one
+    request. Requests of all processes go through `throttle`, as the usage
+    policy of the public instance allows one request per second per client.
+    """
+
+    def __init__(
+        self: typing.Self,
+        client: httpx.AsyncClient,
+        cache: TwoTierCache[list[Place]],
+        *,
+        url: str,
+        user_agent: str,
+        throttle: RedisThrottle | None,
+    ) -> None:
+        self.client = client
+        self.cache = cache
+        self.url = url
+        self.headers = {"User-Agent": user_agent}
+        self.stats: Counter[str] = Counter()
+        self.throttle = throttle
+        self._in_flight: dict[str, asyncio.Task[list[Place]]] = {}
+
+    @staticmethod
+    def _cache_key(query: str, language: str) -> str:
+        normalized = " ".join(query.casefold().split())
+        digest = hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+        return f"{language}:{digest}"
+
+    async def search(self: typing.Self, query: str, language: str) -> list[Place]:
+        key = self._cache_key(query, language)
+        places = await self.cache.get(key)
+        if places is not None:
+            return places
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._search(key, query, language))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        # Don't cancel the request for the others if one of them is cancelled.
+        return await asyncio.shield(task)
+
+    async def _search(
+        self: typing.Self, key: str, query: str, language: str
+    ) -> list[Place]:
+        if self.throttle is not None:
+            await self.throttle.acquire()
+        self.stats["requests"] += 1
+        response = await self.client.get(
+            self.url,
+            params={"format": "jsonv2", "q": query},
+            headers={**self.headers, "Accept-Language": language},
+        )
+        response.raise_for_status()
+        places = [
+            Place(
+                lat=float(place["lat"]),
+                lon=float(place["lon"]),
+                name=place["name"],
+                address=place["display_name"],
+            )
+            for place in response.json()
+        ]
+        await self.cache.set(key, places)
+        return places
+
+
+async def locate_home(
+    map_search: MapSearchRepository, country: str | None, city: str | None
+) -> Place | None:
+    """The place of a user's city, where their routes start from."""
+    if not city or not country:
+        return None
+    places = await map_search.search(f"{country}, {city}")
+    return places[0] if places else None
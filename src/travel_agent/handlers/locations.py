@@ -1,5 +1,5 @@
 from datetime import UTC, date, datetime
-from typing import TYPE_CHECKING, cast
+from typing import TYPE_CHECKING
 
 from telegram import (
     CallbackQuery,
@@ -15,13 +15,21 @@ from telegram.ext import (
     filters,
 )
 
+from travel_agent.callback_data import (
+    get_payload,
+    get_travel_id,
+    has_action,
+    pack,
+    unpack,
+)
 from travel_agent.context import Context
 from travel_agent.handlers.travel import travel_menu
 from travel_agent.middlewares import middlewares
 from travel_agent.models import Location
+from travel_agent.repositories import dump_places, load_places
 from travel_agent.utils import (
     callback_query_callback,
-    check_callback_data,
+    edit_message,
     message_callback,
 )
 
@@ -33,18 +41,17 @@ def create_handlers() -> list[BaseHandler]:
     return [
         ConversationHandler(
             entry_points=[
-                CallbackQueryHandler(
-                    add_location_entry,
-                    lambda data: check_callback_data(data, "newlocation"),
-                )
+                CallbackQueryHandler(add_location_entry, has_action("newlocation"))
             ],
             states={
                 1: [MessageHandler(filters.TEXT, add_location_coord)],
-                2: [CallbackQueryHandler(add_location_start_at)],
+                2: [CallbackQueryHandler(add_location_start_at, has_action("place"))],
                 3: [MessageHandler(filters.TEXT, add_location_end_at)],
                 4: [MessageHandler(filters.TEXT, add_location_end)],
             },
             fallbacks=[],
+            name="newlocation",
+            persistent=True,
         ),
     ]
 
@@ -52,8 +59,12 @@ def create_handlers() -> list[BaseHandler]:
 @middlewares
 @callback_query_callback
 async def add_location_entry(callback_query: CallbackQuery, context: Context) -> int:
-    travel_id = cast(int, callback_query.data[1])  # type: ignore[index]
-    context.user_data["travel_id"] = travel_id  # type: ignore[index]
+    travel_id = await get_travel_id(
+        callback_query, context, unpack(callback_query.data)[0]
+    )
+    if travel_id is None:
+        return ConversationHandler.END
+    context.user_data["travel_id"] = travel_id
     await callback_query.answer()
     await callback_query.message.reply_text("Напишите адрес или отправьте геолокацию.")
     return 1
@@ -63,12 +74,15 @@ async def add_location_entry(callback_query: CallbackQuery, context: Context) ->
 @message_callback
 async def add_location_coord(message: Message, context: Context) -> int:
     places: list[Place] = await context.map_search_repo.search(message.text)
+    places_key = await context.callback_payload_repo.put(dump_places(places))
     await message.reply_text(
         "Что ты имел в виду? :)",
         reply_markup=InlineKeyboardMarkup.from_column(
             [
-                InlineKeyboardButton(f"{place.address}", callback_data=place)
-                for place in places
+                InlineKeyboardButton(
+                    f"{place.address}", callback_data=pack("place", places_key, index)
+                )
+                for index, place in enumerate(places)
             ]
         ),
     )
@@ -80,10 +94,16 @@ async def add_location_coord(message: Message, context: Context) -> int:
 async def add_location_start_at(
     callback_query: CallbackQuery, context: Context
 ) -> None:
-    context.user_data["place"] = callback_query.data
-    await callback_query.edit_message_text(
+    places_key, index = unpack(callback_query.data)
+    places = await get_payload(callback_query, context, places_key)
+    if places is None:
+        return 2
+    context.user_data["place"] = load_places(places)[int(index)]
+    await edit_message(
+        callback_query,
+        context,
         "Отличное место! "
-        "С какой даты вы планируете там быть? Отправьте в формате ДД.ММ.ГГГГ."
+        "С какой даты вы планируете там быть? Отправьте в формате ДД.ММ.ГГГГ.",
     )
     return 3
 
@@ -125,8 +145,9 @@ async def add_location_end(message: Message, context: Context) -> int:
             end_at=end_at,
         )
     )
+    await context.route_repo.invalidate(travel_id)
 
-    travel = await context.travel_repo.get(travel_id)
+    travel = await context.travel_repo.get_header(travel_id)
     await travel_menu(message, context, travel)
 
     return ConversationHandler.END
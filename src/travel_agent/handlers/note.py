@@ -1,83 +1,116 @@
-from dataclasses import dataclass
+import json
 
 from telegram import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from telegram.error import BadRequest
 from telegram.ext import (
     BaseHandler,
-    CallbackQueryHandler,
     MessageHandler,
     filters,
 )
 
+from travel_agent.callback_data import (
+    CallbackQueryDispatcher,
+    get_payload,
+    get_travel_id,
+    pack,
+    unpack,
+)
 from travel_agent.context import Context
 from travel_agent.middlewares import middlewares
 from travel_agent.models import Note
 from travel_agent.utils import (
+    build_page_navigation,
     callback_query_callback,
-    check_callback_data,
+    edit_message,
     message_callback,
 )
 
 
 def create_handlers() -> list[BaseHandler]:
     return [
-        CallbackQueryHandler(
-            note_list, lambda data: check_callback_data(data, "travel_note_list")
-        ),
-        CallbackQueryHandler(
-            show_note, lambda data: check_callback_data(data, "travel_note")
+        CallbackQueryDispatcher(
+            {
+                "travel_note_list": note_list,
+                "travel_note": show_note,
+                "note_travel": note_travel,
+                "note_public": note_public,
+            }
         ),
         MessageHandler(filters.Document.ALL | filters.PHOTO, note_entry),
-        CallbackQueryHandler(
-            note_travel, lambda data: check_callback_data(data, "note_travel")
-        ),
-        CallbackQueryHandler(
-            note_public, lambda data: check_callback_data(data, "note_public")
-        ),
     ]
 
 
-@dataclass
-class TempNote:
-    id: str
-    name: str
-    travel_id: int
-
-
 @middlewares
 @callback_query_callback
 async def note_list(callback_query: CallbackQuery, context: Context) -> None:
-    travel_id: int = callback_query.data[1]
-    travel = await context.travel_repo.get(travel_id)
-    await callback_query.message.edit_text(
-        f"<b>Заметки путешествия «{travel.name}»</b>"
+    args = unpack(callback_query.data)
+    travel_id = await get_travel_id(callback_query, context, args[0])
+    if travel_id is None:
+        return
+    after_id = before_id = None
+    if len(args) > 1:
+        direction, ids_key, boundary = args[1:]
+        note_ids = await get_payload(callback_query, context, ids_key)
+        if note_ids is None:
+            return
+        cursor = json.loads(note_ids)[int(boundary)]
+        if direction == "prev":
+            before_id = cursor
+        else:
+            after_id = cursor
+
+    travel = await context.travel_repo.get_header(travel_id)
+    page = await context.note_repo.page_visible(
+        travel_id,
+        callback_query.from_user.id,
+        after_id=after_id,
+        before_id=before_id,
     )
-    await callback_query.message.edit_reply_markup(
-        InlineKeyboardMarkup.from_column(
-            [
-                *[
-                    InlineKeyboardButton(
-                        f"«{note.name}»", callback_data=("travel_note", note.id)
-                    )
-                    for note in travel.notes
-                    if (
-                        note.is_private is False
-                        or note.user_id == callback_query.from_user.id
-                    )
-                ],
-                InlineKeyboardButton(
-                    "<< К путешествию", callback_data=("travel", travel_id)
-                ),
-            ]
-        )
+
+    # Note IDs are file IDs, which don't fit into callback data.
+    ids_key = await context.callback_payload_repo.put(
+        json.dumps([note.id for note in page.items]).encode()
+    )
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"«{note.name}»", callback_data=pack("travel_note", ids_key, index)
+            )
+        ]
+        for index, note in enumerate(page.items)
+    ]
+    navigation = build_page_navigation(
+        page,
+        lambda direction, index: pack(
+            "travel_note_list", travel_id, direction, ids_key, index
+        ),
+    )
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append(
+        [
+            InlineKeyboardButton(
+                "<< К путешествию", callback_data=pack("travel", travel_id)
+            )
+        ]
+    )
+
+    await edit_message(
+        callback_query,
+        context,
+        f"<b>Заметки путешествия «{travel.name}»</b>",
+        InlineKeyboardMarkup(keyboard),
     )
 
 
 @middlewares
 @callback_query_callback
 async def show_note(callback_query: CallbackQuery, context: Context) -> None:
-    note_id: int = callback_query.data[1]
-    note = await context.note_repo.get(note_id)
+    ids_key, index = unpack(callback_query.data)
+    note_ids = await get_payload(callback_query, context, ids_key)
+    if note_ids is None:
+        return
+    note = await context.note_repo.get(json.loads(note_ids)[int(index)])
     await callback_query.answer()
     try:
         await callback_query.message.reply_photo(note.id, caption=note.name)
@@ -94,19 +127,19 @@ async def note_entry(message: Message, context: Context) -> int:
     if message.document:
         note_id = message.document.file_id
 
-    user = await context.user_repo.get(message.from_user.id)
+    travels = await context.travel_repo.list_names_by_user(message.from_user.id)
+    note_key = await context.callback_payload_repo.put(
+        json.dumps([note_id, message.caption]).encode()
+    )
     await message.reply_text(
         "Увидел! Укажи к какому путешествию её прикрепить.",
         reply_markup=InlineKeyboardMarkup.from_column(
             [
                 InlineKeyboardButton(
                     f"«{travel.name}»",
-                    callback_data=(
-                        "note_travel",
-                        TempNote(id=note_id, name=message.caption, travel_id=travel.id),
-                    ),
+                    callback_data=pack("note_travel", note_key, travel.id),
                 )
-                for travel in user.travels
+                for travel in travels
             ]
         ),
     )
@@ -117,28 +150,36 @@ async def note_entry(message: Message, context: Context) -> int:
 @middlewares
 @callback_query_callback
 async def note_travel(callback_query: CallbackQuery, context: Context) -> None:
-    temp_note: TempNote = callback_query.data[1]
+    note_key, arg = unpack(callback_query.data)
+    travel_id = await get_travel_id(callback_query, context, arg)
+    if travel_id is None:
+        return
+    payload = await get_payload(callback_query, context, note_key)
+    if payload is None:
+        return
+    note_id, name = json.loads(payload)
 
     note = Note(
-        id=temp_note.id,
-        name=temp_note.name,
+        id=note_id,
+        name=name,
         user_id=callback_query.from_user.id,
-        travel_id=temp_note.travel_id,
+        travel_id=travel_id,
         is_private=True,
     )
     await context.note_repo.add(note)
+    note_id_key = await context.callback_payload_repo.put(note.id.encode())
 
-    travel = await context.travel_repo.get(temp_note.travel_id)
-    await callback_query.message.edit_text(
+    travel = await context.travel_repo.get_header(note.travel_id)
+    await edit_message(
+        callback_query,
+        context,
         f"Добавил в путешествие «{travel.name}»!\n"
         "Если хочешь, чтобы заметка была доступна всем в путешествии, "
         "то нажми на кнопку.",
-    )
-
-    await callback_query.message.edit_reply_markup(
         InlineKeyboardMarkup.from_button(
             InlineKeyboardButton(
-                "Сделать заметку публичной", callback_data=("note_public", note.id)
+                "Сделать заметку публичной",
+                callback_data=pack("note_public", note_id_key),
             )
         ),
     )
@@ -147,8 +188,11 @@ async def note_travel(callback_query: CallbackQuery, context: Context) -> None:
 @middlewares
 @callback_query_callback
 async def note_public(callback_query: CallbackQuery, context: Context) -> None:
-    note_id: int = callback_query.data[1]
-    note = await context.note_repo.get(note_id)
+    (note_id_key,) = unpack(callback_query.data)
+    note_id = await get_payload(callback_query, context, note_id_key)
+    if note_id is None:
+        return
+    note = await context.note_repo.get(note_id.decode())
     note.is_private = False
     await context.note_repo.update(note)
 
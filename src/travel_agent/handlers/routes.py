@@ -1,23 +1,15 @@
-import io
-from typing import cast
-
-import staticmap
 from telegram import CallbackQuery
 from telegram.constants import ChatAction
-from telegram.ext import BaseHandler, CallbackQueryHandler
+from telegram.ext import BaseHandler
 
+from travel_agent.callback_data import CallbackQueryDispatcher, get_travel_id, unpack
 from travel_agent.context import Context
 from travel_agent.middlewares import middlewares
-from travel_agent.utils import callback_query_callback, check_callback_data
+from travel_agent.utils import callback_query_callback
 
 
 def create_handlers() -> list[BaseHandler]:
-    return [
-        CallbackQueryHandler(
-            build_route_of_travel,
-            lambda data: check_callback_data(data, "travel_build_full_route"),
-        )
-    ]
+    return [CallbackQueryDispatcher({"travel_build_full_route": build_route_of_travel})]
 
 
 @middlewares
@@ -25,31 +17,32 @@ def create_handlers() -> list[BaseHandler]:
 async def build_route_of_travel(
     callback_query: CallbackQuery, context: Context
 ) -> None:
-    travel_id = cast(int, callback_query.data[1])
-    travel = await context.travel_repo.get(travel_id)
+    travel_id = await get_travel_id(
+        callback_query, context, unpack(callback_query.data)[0]
+    )
+    if travel_id is None:
+        return
+    travel = await context.travel_repo.get_header(travel_id)
     await callback_query.answer()
 
     points = [(location.lon, location.lat) for location in travel.locations]
 
     user = await context.user_repo.get(callback_query.from_user.id)
-    if user.city and user.country:
-        places = await context.map_search_repo.search(f"{user.country}, {user.city}")
-        points.insert(0, (places[0].lon, places[0].lat))
+    if user.home_lat is not None and user.home_lon is not None:
+        points.insert(0, (user.home_lon, user.home_lat))
+
+    fingerprint = context.map_renderer.fingerprint(points)
+    file_id = await context.route_map_repo.get_file_id(fingerprint)
+    if file_id is not None:
+        await callback_query.message.reply_photo(file_id)
+        return
 
-    route = await context.route_repo.create_car_route(*points)
+    route = await context.route_repo.create_car_route(*points, travel_id=travel_id)
 
     await context.bot.send_chat_action(
         chat_id=callback_query.message.chat.id, action=ChatAction.UPLOAD_PHOTO
     )
 
-    # TODO: staticmap uses thread pool and requests.
-    # We should rewrite it for asyncio.
-    route_map = staticmap.StaticMap(1024, 1024)
-    route_map.add_line(staticmap.Line(route, "blue", 3))
-    for point in points:
-        route_map.add_marker(staticmap.CircleMarker(point, "blue", 10))
-    image = route_map.render()
-
-    with io.BytesIO() as fp:
-        image.save(fp, format="png", optimize=True)
-        await callback_query.message.reply_photo(fp.getvalue())
+    image = await context.map_renderer.render(route, points)
+    message = await callback_query.message.reply_photo(image)
+    await context.route_map_repo.set_file_id(fingerprint, message.photo[-1].file_id)
@@ -1,3 +1,6 @@
+import contextlib
+import typing
+
 from telegram import (
     CallbackQuery,
     InlineKeyboardButton,
@@ -14,9 +17,15 @@ from telegram.ext import (
 )
 
 from travel_agent.context import Context
+from travel_agent.geocoding import SEARCH_ERRORS, locate_home
 from travel_agent.middlewares import middlewares
-from travel_agent.models import SexEnum, User
-from travel_agent.utils import callback_query_callback, message_callback
+from travel_agent.models import SexEnum
+from travel_agent.repositories import Profile
+from travel_agent.utils import (
+    callback_query_callback,
+    edit_message,
+    message_callback,
+)
 
 
 def create_handlers() -> list[BaseHandler]:
@@ -26,6 +35,8 @@ def create_handlers() -> list[BaseHandler]:
             entry_points=[CallbackQueryHandler(settings_age, "^settings_age$")],
             states={1: [MessageHandler(filters.TEXT, settings_age_answered)]},
             fallbacks=[],
+            name="settings_age",
+            persistent=True,
         ),
         CallbackQueryHandler(settings_sex, "^settings_sex$"),
         CallbackQueryHandler(settings_sex_male, "^settings_sex_male$"),
@@ -35,21 +46,45 @@ def create_handlers() -> list[BaseHandler]:
             entry_points=[CallbackQueryHandler(settings_city, "^settings_city$")],
             states={1: [MessageHandler(filters.TEXT, settings_city_answered)]},
             fallbacks=[],
+            name="settings_city",
+            persistent=True,
         ),
         ConversationHandler(
             entry_points=[CallbackQueryHandler(settings_country, "^settings_country$")],
             states={1: [MessageHandler(filters.TEXT, settings_country_answered)]},
             fallbacks=[],
+            name="settings_country",
+            persistent=True,
         ),
         ConversationHandler(
             entry_points=[CallbackQueryHandler(settings_bio, "^settings_bio$")],
             states={1: [MessageHandler(filters.TEXT, settings_bio_answered)]},
             fallbacks=[],
+            name="settings_bio",
+            persistent=True,
         ),
     ]
 
 
-def get_text(user: User) -> str:
+SETTINGS_KEYBOARD: typing.Final = InlineKeyboardMarkup.from_column(
+    (
+        InlineKeyboardButton("Указать возраст", callback_data="settings_age"),
+        InlineKeyboardButton("Указать пол", callback_data="settings_sex"),
+        InlineKeyboardButton("Указать город", callback_data="settings_city"),
+        InlineKeyboardButton("Указать страну", callback_data="settings_country"),
+        InlineKeyboardButton("Изменить описание", callback_data="settings_bio"),
+    )
+)
+SEX_KEYBOARD: typing.Final = InlineKeyboardMarkup.from_column(
+    (
+        InlineKeyboardButton("Мужской", callback_data="settings_sex_male"),
+        InlineKeyboardButton("Женский", callback_data="settings_sex_female"),
+        InlineKeyboardButton("Назад", callback_data="settings_sex_back"),
+    )
+)
+
+
+def get_text(user: Profile) -> str:
     sex_to_str = {
         "male": "Мужской",
         "female": "Женский",
@@ -65,54 +100,51 @@ def get_text(user: User) -> str:
     )
 
 
-async def settings_menu(message: Message, context: Context) -> None:
-    user = await context.user_repo.get(message.from_user.id)
-    await message.reply_text(
-        get_text(user),
-        reply_markup=InlineKeyboardMarkup.from_column(
-            (
-                InlineKeyboardButton("Указать возраст", callback_data="settings_age"),
-                InlineKeyboardButton("Указать пол", callback_data="settings_sex"),
-                InlineKeyboardButton("Указать город", callback_data="settings_city"),
-                InlineKeyboardButton(
-                    "Указать страну", callback_data="settings_country"
-                ),
-                InlineKeyboardButton("Изменить описание", callback_data="settings_bio"),
-            )
-        ),
+async def update_home(context: Context, user_id: int, **values: str) -> Profile:
+    """Set the city or the country, and the home if they have changed."""
+    profile = await context.user_repo.get_profile(user_id)
+    home = {"city": profile.city, "country": profile.country}
+    if all(home[name] == value for name, value in values.items()):
+        return profile
+    home.update(values)
+
+    place = None
+    # Saving the profile shouldn't fail because of the geocoder. The home
+    # stays empty then and is filled in by the backfill command.
+    with contextlib.suppress(*SEARCH_ERRORS):
+        place = await locate_home(
+            context.map_search_repo, home["country"], home["city"]
+        )
+    return await context.user_repo.update_profile(
+        user_id,
+        **values,
+        home_lat=place.lat if place is not None else None,
+        home_lon=place.lon if place is not None else None,
     )
 
 
+async def settings_menu(message: Message, profile: Profile) -> None:
+    await message.reply_text(get_text(profile), reply_markup=SETTINGS_KEYBOARD)
+
+
 async def back_to_settings_menu(
-    callback_query: CallbackQuery, context: Context
+    callback_query: CallbackQuery, context: Context, profile: Profile
 ) -> None:
-    user = await context.user_repo.get(callback_query.from_user.id)
-    await callback_query.edit_message_text(get_text(user))
-    await callback_query.edit_message_reply_markup(
-        InlineKeyboardMarkup.from_column(
-            (
-                InlineKeyboardButton("Указать возраст", callback_data="settings_age"),
-                InlineKeyboardButton("Указать пол", callback_data="settings_sex"),
-                InlineKeyboardButton("Указать город", callback_data="settings_city"),
-                InlineKeyboardButton(
-                    "Указать страну", callback_data="settings_country"
-                ),
-                InlineKeyboardButton("Изменить описание", callback_data="settings_bio"),
-            )
-        )
-    )
+    await edit_message(callback_query, context, get_text(profile), SETTINGS_KEYBOARD)
 
 
 @middlewares
 @message_callback
 async def settings(message: Message, context: Context) -> None:
-    await settings_menu(message, context)
+    profile = await context.user_repo.get_profile(message.from_user.id)
+    await settings_menu(message, profile)
 
 
 @middlewares
 @callback_query_callback
 async def back_to_settings(callback_query: CallbackQuery, context: Context) -> None:
-    await back_to_settings_menu(callback_query, context)
+    profile = await context.user_repo.get_profile(callback_query.from_user.id)
+    await back_to_settings_menu(callback_query, context, profile)
 
 
 @middlewares
@@ -132,46 +164,36 @@ async def settings_age_answered(message: Message, context: Context) -> int:
         age = int(message.text)
     except ValueError:
         await message.reply_text("Неверный формат")
-    user = await context.user_repo.get(message.from_user.id)
-    user.age = age
-    await context.user_repo.update(user)
-    await settings_menu(message, context)
+        return 1
+    profile = await context.user_repo.update_profile(message.from_user.id, age=age)
+    await settings_menu(message, profile)
     return ConversationHandler.END
 
 
 @middlewares
 @callback_query_callback
-async def settings_sex(callback_query: CallbackQuery, _: Context) -> None:
-    await callback_query.message.edit_text("Выберите пол:")
-    await callback_query.message.edit_reply_markup(
-        InlineKeyboardMarkup.from_column(
-            (
-                InlineKeyboardButton("Мужской", callback_data="settings_sex_male"),
-                InlineKeyboardButton("Женский", callback_data="settings_sex_female"),
-                InlineKeyboardButton("Назад", callback_data="settings_sex_back"),
-            )
-        )
-    )
+async def settings_sex(callback_query: CallbackQuery, context: Context) -> None:
+    await edit_message(callback_query, context, "Выберите пол:", SEX_KEYBOARD)
 
 
 @middlewares
 @callback_query_callback
 async def settings_sex_male(callback_query: CallbackQuery, context: Context) -> None:
-    user = await context.user_repo.get(callback_query.from_user.id)
-    user.sex = SexEnum.male
-    await context.user_repo.update(user)
+    profile = await context.user_repo.update_profile(
+        callback_query.from_user.id, sex=SexEnum.male
+    )
     await callback_query.answer("Обновлено!")
-    await back_to_settings_menu(callback_query, context)
+    await back_to_settings_menu(callback_query, context, profile)
 
 
 @middlewares
 @callback_query_callback
 async def settings_sex_female(callback_query: CallbackQuery, context: Context) -> None:
-    user = await context.user_repo.get(callback_query.from_user.id)
-    user.sex = SexEnum.female
-    await context.user_repo.update(user)
+    profile = await context.user_repo.update_profile(
+        callback_query.from_user.id, sex=SexEnum.female
+    )
     await callback_query.answer("Обновлено!")
-    await back_to_settings_menu(callback_query, context)
+    await back_to_settings_menu(callback_query, context, profile)
 
 
 @middlewares
@@ -187,10 +209,8 @@ async def settings_city(callback_query: CallbackQuery, _: Context) -> int:
 @middlewares
 @message_callback
 async def settings_city_answered(message: Message, context: Context) -> int:
-    user = await context.user_repo.get(message.from_user.id)
-    user.city = message.text
-    await context.user_repo.update(user)
-    await settings_menu(message, context)
+    profile = await update_home(context, message.from_user.id, city=message.text)
+    await settings_menu(message, profile)
     return ConversationHandler.END
 
 
@@ -207,10 +227,8 @@ async def settings_country(callback_query: CallbackQuery, _: Context) -> int:
 @middlewares
 @message_callback
 async def settings_country_answered(message: Message, context: Context) -> int:
-    user = await context.user_repo.get(message.from_user.id)
-    user.country = message.text
-    await context.user_repo.update(user)
-    await settings_menu(message, context)
+    profile = await update_home(context, message.from_user.id, country=message.text)
+    await settings_menu(message, profile)
     return ConversationHandler.END
 
 
@@ -227,8 +245,8 @@ async def settings_bio(callback_query: CallbackQuery, _: Context) -> int:
 @middlewares
 @message_callback
 async def settings_bio_answered(message: Message, context: Context) -> int:
-    user = await context.user_repo.get(message.from_user.id)
-    user.bio = message.text
-    await context.user_repo.update(user)
-    await settings_menu(message, context)
+    profile = await context.user_repo.update_profile(
+        message.from_user.id, bio=message.text
+    )
+    await settings_menu(message, profile)
     return ConversationHandler.END
@@ -17,21 +17,16 @@ async def start(message: telegram.Message, context: Context) -> None:
         await context.travel_repo.add_user_to(
             travel_id=travel_id, user_id=message.from_user.id
         )
-        travel = await context.travel_repo.get(travel_id)
-        for user in travel.users:
-            if user.id == message.from_user.id:
-                await message.reply_text(
-                    f"Тебя пригласили в путешествие «{travel.name}»!"
-                )
-                continue
-            await context.bot.send_message(
-                chat_id=user.id,
-                text=(
-                    f"Добавлен Путник в путешествие «{travel.name}»: "
-                    + get_mention(message.from_user)
-                    + "."
-                ),
-            )
+        travel = await context.travel_repo.get_header(travel_id)
+        text = (
+            f"Добавлен Путник в путешествие «{travel.name}»: "
+            + get_mention(message.from_user)
+            + "."
+        )
+        for user_id in await context.travel_repo.get_member_ids(travel_id):
+            if user_id != message.from_user.id:
+                context.notifications.notify(user_id, text)
+        await message.reply_text(f"Тебя пригласили в путешествие «{travel.name}»!")
         return
 
     await message.reply_text(context.l10n.get("start"))
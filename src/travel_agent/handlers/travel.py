@@ -18,12 +18,21 @@ from telegram.ext import (
 )
 from telegram.helpers import create_deep_linked_url
 
+from travel_agent.callback_data import (
+    CallbackQueryDispatcher,
+    get_travel_id,
+    has_action,
+    pack,
+    unpack,
+)
 from travel_agent.context import Context
 from travel_agent.middlewares import middlewares
 from travel_agent.models import Travel
+from travel_agent.repositories import Page, TravelHeader
 from travel_agent.utils import (
+    build_page_navigation,
     callback_query_callback,
-    check_callback_data,
+    edit_message,
     message_callback,
 )
 
@@ -41,12 +50,8 @@ class ChangeBioState(enum.Enum):
 def create_handlers() -> list[BaseHandler]:
     return [
         CommandHandler("travels", travels_cmd),
-        CallbackQueryHandler(
-            travels_button, lambda data: check_callback_data(data, "travels")
-        ),
-        CallbackQueryHandler(travel, lambda data: check_callback_data(data, "travel")),
-        CallbackQueryHandler(
-            rmtravel, lambda data: check_callback_data(data, "rmtravel")
+        CallbackQueryDispatcher(
+            {"travels": travels_button, "travel": travel, "rmtravel": rmtravel}
         ),
         ConversationHandler(
             entry_points=[CommandHandler("newtravel", newtravel_entry)],
@@ -56,39 +61,45 @@ def create_handlers() -> list[BaseHandler]:
                 ]
             },
             fallbacks=[],
+            name="newtravel",
+            persistent=True,
         ),
         ConversationHandler(
             entry_points=[
-                CallbackQueryHandler(
-                    change_bio_entry,
-                    lambda data: check_callback_data(data, "travel_bio"),
-                )
+                CallbackQueryHandler(change_bio_entry, has_action("travel_bio"))
             ],
             states={
                 ChangeBioState.BIO.value: [MessageHandler(filters.TEXT, change_bio_end)]
             },
             fallbacks=[],
+            name="travel_bio",
+            persistent=True,
         ),
     ]
 
 
-def build_keyboard(travel_id: int, bot_username: str, invite_token: str) -> None:
+# Buttons of the travel menu that act on the travel, in order.
+TRAVEL_ACTIONS: typing.Final = (
+    ("🗒️ Заметки", "travel_note_list"),
+    ("🗺️ Маршрут", "travel_build_full_route"),
+    ("📍 Добавить локацию", "newlocation"),
+    ("📝 Изменить описание", "travel_bio"),
+    ("❌ Удалить", "rmtravel"),
+)
+BACK_TO_TRAVELS_BUTTON: typing.Final = InlineKeyboardButton(
+    "<< Все путешествия", callback_data="travels"
+)
+
+
+def build_keyboard(
+    travel_id: int, bot_username: str, invite_token: str
+) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup.from_column(
         (
-            InlineKeyboardButton(
-                "🗒️ Заметки", callback_data=("travel_note_list", travel_id)
+            *(
+                InlineKeyboardButton(text, callback_data=pack(action, travel_id))
+                for text, action in TRAVEL_ACTIONS
             ),
-            InlineKeyboardButton(
-                "🗺️ Маршрут",
-                callback_data=("travel_build_full_route", travel_id),
-            ),
-            InlineKeyboardButton(
-                "📍 Добавить локацию", callback_data=("newlocation", travel_id)
-            ),
-            InlineKeyboardButton(
-                "📝 Изменить описание", callback_data=("travel_bio", travel_id)
-            ),
-            InlineKeyboardButton("❌ Удалить", callback_data=("rmtravel", travel_id)),
             InlineKeyboardButton(
                 "🔗 Пригласить",
                 url=(
@@ -96,24 +107,46 @@ def build_keyboard(travel_id: int, bot_username: str, invite_token: str) -> None
                     + create_deep_linked_url(bot_username, invite_token)
                 ),
             ),
-            InlineKeyboardButton("<< Все путешествия", callback_data="travels"),
+            BACK_TO_TRAVELS_BUTTON,
         )
     )
 
 
-async def travel_menu(message: Message, context: Context, travel: Travel) -> None:
-    me = await context.bot.get_me()
-    invite_token: str = await context.invite_token_repo.create(travel.id)
+def get_text(travel: TravelHeader) -> str:
     bio = travel.bio if travel.bio is not None else ""
+    return f"<b>🧳 «{travel.name}»</b>\n\n<b>Описание:</b> «{bio}».\n\n" + "\n\n".join(
+        f"<b>{location.start_at.strftime('%d.%m.%Y')}—{location.end_at.strftime('%d.%m.%Y')}</b>\n"
+        f"<b>«{location.name}»</b> "
+        for location in travel.locations
+    )
+
+
+def build_travels_keyboard(page: Page) -> InlineKeyboardMarkup:
+    keyboard = [
+        [
+            InlineKeyboardButton(
+                f"«{travel.name}»", callback_data=pack("travel", travel.id)
+            )
+        ]
+        for travel in page.items
+    ]
+    navigation = build_page_navigation(
+        page,
+        lambda direction, index: pack("travels", direction, page.items[index].id),
+    )
+    if navigation:
+        keyboard.append(navigation)
+    return InlineKeyboardMarkup(keyboard)
+
+
+async def travel_menu(message: Message, context: Context, travel: TravelHeader) -> None:
+    invite_token: str = await context.invite_token_repo.create(travel.id)
     await message.reply_text(
-        f"<b>🧳 «{travel.name}»</b>\n\n<b>Описание:</b> «{bio}».\n\n"
-        + "\n\n".join(
-            f"<b>{location.start_at.strftime('%d.%m.%Y')}—{location.end_at.strftime('%d.%m.%Y')}</b>\n"
-            f"<b>«{location.name}»</b> "
-            for location in travel.locations
-        ),
+        get_text(travel),
         reply_markup=build_keyboard(
-            travel_id=travel.id, bot_username=me.username, invite_token=invite_token
+            travel_id=travel.id,
+            bot_username=context.bot.username,
+            invite_token=invite_token,
         ),
     )
 
@@ -121,59 +154,50 @@ async def travel_menu(message: Message, context: Context, travel: Travel) -> Non
 @middlewares
 @message_callback
 async def travels_cmd(message: Message, context: Context) -> None:
-    user = await context.user_repo.get(message.from_user.id)
+    page = await context.travel_repo.page_names_by_user(message.from_user.id)
     await message.reply_text(
-        "<b>Путешествия</b>",
-        reply_markup=InlineKeyboardMarkup.from_column(
-            [
-                InlineKeyboardButton(
-                    f"«{travel.name}»", callback_data=("travel", travel.id)
-                )
-                for travel in user.travels
-                if travel.is_deleted is False
-            ]
-        ),
+        "<b>Путешествия</b>", reply_markup=build_travels_keyboard(page)
     )
 
 
 @middlewares
 @callback_query_callback
 async def travels_button(callback_query: CallbackQuery, context: Context) -> None:
-    user = await context.user_repo.get(callback_query.from_user.id)
-    await callback_query.message.edit_text("<b>Путешествия</b>")
-    await callback_query.message.edit_reply_markup(
-        InlineKeyboardMarkup.from_column(
-            [
-                InlineKeyboardButton(
-                    f"«{travel.name}»", callback_data=("travel", travel.id)
-                )
-                for travel in user.travels
-                if travel.is_deleted is False
-            ]
-        )
+    after_id = before_id = None
+    if args := unpack(callback_query.data):
+        direction, cursor = args[0], int(args[1])
+        if direction == "prev":
+            before_id = cursor
+        else:
+            after_id = cursor
+
+    page = await context.travel_repo.page_names_by_user(
+        callback_query.from_user.id, after_id=after_id, before_id=before_id
+    )
+    await edit_message(
+        callback_query, context, "<b>Путешествия</b>", build_travels_keyboard(page)
     )
 
 
 @middlewares
 @callback_query_callback
 async def travel(callback_query: CallbackQuery, context: Context) -> None:
-    travel_id = typing.cast(int, callback_query.data[1])
-    travel = await context.travel_repo.get(travel_id)
-    me = await context.bot.get_me()
-    invite_token: str = await context.invite_token_repo.create(travel.id)
-    bio = travel.bio if travel.bio is not None else ""
-    await callback_query.message.edit_text(
-        f"<b>🧳 «{travel.name}»</b>\n\n<b>Описание:</b> «{bio}».\n\n"
-        + "\n\n".join(
-            f"<b>{location.start_at.strftime('%d.%m.%Y')}—{location.end_at.strftime('%d.%m.%Y')}</b>\n"
-            f"<b>«{location.name}»</b> "
-            for location in travel.locations
-        ),
+    travel_id = await get_travel_id(
+        callback_query, context, unpack(callback_query.data)[0]
     )
-    await callback_query.message.edit_reply_markup(
+    if travel_id is None:
+        return
+    travel = await context.travel_repo.get_header(travel_id)
+    invite_token: str = await context.invite_token_repo.create(travel.id)
+    await edit_message(
+        callback_query,
+        context,
+        get_text(travel),
         build_keyboard(
-            travel_id=travel.id, bot_username=me.username, invite_token=invite_token
-        )
+            travel_id=travel.id,
+            bot_username=context.bot.username,
+            invite_token=invite_token,
+        ),
     )
 
 
@@ -201,10 +225,11 @@ async def newtravel_name(message: Message, context: Context) -> int:
 
     travel_id = travel.id
 
-    user = await context.user_repo.get(message.from_user.id)
-    await context.travel_repo.add_user_to(travel_id=travel.id, user_id=user.id)
+    await context.travel_repo.add_user_to(
+        travel_id=travel_id, user_id=message.from_user.id
+    )
 
-    travel = await context.travel_repo.get(travel_id)
+    travel = await context.travel_repo.get_header(travel_id)
     await travel_menu(message, context, travel)
 
     return NewTravelState.END.value
@@ -213,7 +238,12 @@ async def newtravel_name(message: Message, context: Context) -> int:
 @middlewares
 @callback_query_callback
 async def change_bio_entry(callback_query: CallbackQuery, context: Context) -> int:
-    context.user_data["travel_id"] = typing.cast(int, callback_query.data[1])
+    travel_id = await get_travel_id(
+        callback_query, context, unpack(callback_query.data)[0]
+    )
+    if travel_id is None:
+        return ChangeBioState.END.value
+    context.user_data["travel_id"] = travel_id
     await callback_query.answer()
     await callback_query.message.reply_text("Придумай описание для путешествия.")
     return ChangeBioState.BIO.value
@@ -223,11 +253,8 @@ async def change_bio_entry(callback_query: CallbackQuery, context: Context) -> i
 @message_callback
 async def change_bio_end(message: Message, context: Context) -> int:
     travel_id: int = context.user_data["travel_id"]
-    await context.travel_repo.update(
-        Travel(id=travel_id, bio=message.text),
-        attribute_names=("bio",),
-    )
-    travel = await context.travel_repo.get(travel_id)
+    await context.travel_repo.update_travel(travel_id, bio=message.text)
+    travel = await context.travel_repo.get_header(travel_id)
     await travel_menu(message, context, travel)
     return ChangeBioState.END.value
 
@@ -235,23 +262,18 @@ async def change_bio_end(message: Message, context: Context) -> int:
 @middlewares
 @callback_query_callback
 async def rmtravel(callback_query: CallbackQuery, context: Context) -> None:
-    travel_id: int = callback_query.data[1]
+    travel_id = await get_travel_id(
+        callback_query, context, unpack(callback_query.data)[0]
+    )
+    if travel_id is None:
+        return
 
-    travel = await context.travel_repo.get(travel_id)
-    travel.is_deleted = True
-    await context.travel_repo.update(travel)
+    await context.travel_repo.update_travel(travel_id, is_deleted=True)
+    await context.route_repo.invalidate(travel_id)
+    await context.invite_token_repo.revoke(travel_id)
     await callback_query.answer("Удалено!")
 
-    user = await context.user_repo.get(callback_query.from_user.id)
-    await callback_query.edit_message_text("<b>Путешествия</b>")
-    await callback_query.edit_message_reply_markup(
-        InlineKeyboardMarkup.from_column(
-            [
-                InlineKeyboardButton(
-                    f"«{travel.name}»", callback_data=("travel", travel.id)
-                )
-                for travel in user.travels
-                if travel.is_deleted is False
-            ]
-        ),
+    page = await context.travel_repo.page_names_by_user(callback_query.from_user.id)
+    await edit_message(
+        callback_query, context, "<b>Путешествия</b>", build_travels_keyboard(page)
     )
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from dataclasses import dataclass
+
+import httpx
+
+
+@dataclass
+class PoolStats:
+    connections: int = 0
+    active: int = 0
+    idle: int = 0
+    http2: int = 0
+
+
+def create_http_client(  # noqa: PLR0913
+    *,
+    max_connections: int,
+    max_keepalive_connections: int,
+    keepalive_expiry: float,
+    timeout: float,
+    connect_timeout: float,
+    http2: bool,
+) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=httpx.Timeout(timeout, connect=connect_timeout),
+        http2=http2,
+    )
+
+
+def get_pool_stats(client: httpx.AsyncClient) -> dict[str, PoolStats]:
+    # httpx doesn't expose its connection pool, so we look into httpcore directly.
+    pool = client._transport._pool  # type: ignore[attr-defined]  # noqa: SLF001
+    stats: defaultdict[str, PoolStats] = defaultdict(PoolStats)
+    for connection in pool.connections:
+        origin = connection._origin  # noqa: SLF001
+        host_stats = stats[
+            f"{origin.scheme.decode()}://{origin.host.decode()}:{origin.port}"
+        ]
+        host_stats.connections += 1
+        if connection.is_idle():
+            host_stats.idle += 1
+        else:
+            host_stats.active += 1
+        if "HTTP/2" in connection.info():
+            host_stats.http2 += 1
+    return dict(stats)
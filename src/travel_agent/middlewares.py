@@ -1,43 +1,28 @@
 import functools
-import typing
 
-import httpx
-from redis.asyncio import Redis
 from telegram import Update
 
 from travel_agent.context import Context
-from travel_agent.models import User
 from travel_agent.types import Callback
 
-if typing.TYPE_CHECKING:
-    from sqlalchemy.ext.asyncio import AsyncSession
-
 
 def middlewares(function: Callback) -> Callback:
     @functools.wraps(function)
     async def wrapped(update: Update, context: Context) -> None:
-        db_session_factory = context.bot_data["db_session_factory"]
-        db_session: "AsyncSession" = db_session_factory()
-        context.data["db_session"] = db_session
-
-        redis_pool = context.bot_data["redis_pool"]
-        redis_client = Redis.from_pool(redis_pool)
-        context.data["redis_client"] = redis_client
-
-        httpx_client = httpx.AsyncClient()
-        context.data["httpx_client"] = httpx_client
-
         try:
-            user = await context.user_repo.get_one_or_none(id=update.effective_user.id)
-            if user is None:
-                await context.user_repo.add(User(id=update.effective_user.id))
+            user_id = update.effective_user.id
+            known_users = context.bot_data["known_users"]
+            if known_users.get(user_id) is None:
+                await context.user_repo.ensure_exists(user_id)
+                known_users[user_id] = True
 
             result = await function(update, context)
 
         finally:
-            await db_session.close()
-            await redis_client.aclose()
-            await httpx_client.aclose()
+            await context.close_resources()
+            resource_usage = context.bot_data["resource_usage"]
+            resource_usage["updates"] += 1
+            resource_usage.update(context.used_resources)
 
         return result
 
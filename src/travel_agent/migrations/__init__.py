@@ -0,0 +1,87 @@
+"""Versioned schema migrations, run with Alembic.
+
+Revisions live in `versions/` and are written by hand. Pending ones are
+applied at startup or with `python -m travel_agent migrate`.
+"""
+
+import asyncio
+import contextlib
+import typing
+from collections.abc import AsyncIterator
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import Connection, func, inspect, select
+
+if typing.TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
+
+MIGRATIONS_DIR: typing.Final = Path(__file__).parent
+# Databases created with `create_all` before migrations existed.
+BASELINE_REVISION: typing.Final = "0001"
+# Key of the PostgreSQL advisory lock held while migrating.
+LOCK_ID: typing.Final = 0x7472_6176_656C
+LOCK_POLL_INTERVAL: typing.Final = 0.5
+
+
+def get_config() -> Config:
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    return config
+
+
+def get_head_revision() -> str | None:
+    return ScriptDirectory.from_config(get_config()).get_current_head()
+
+
+def _get_current_revision(connection: Connection) -> str | None:
+    return MigrationContext.configure(connection).get_current_revision()
+
+
+def _upgrade(connection: Connection, revision: str) -> None:
+    config = get_config()
+    config.attributes["connection"] = connection
+    if _get_current_revision(connection) is None and inspect(connection).has_table(
+        "user"
+    ):
+        command.stamp(config, BASELINE_REVISION)
+    # Let Alembic manage transactions, some migrations run outside of them.
+    connection.commit()
+    command.upgrade(config, revision)
+
+
+async def get_current_revision(engine: "AsyncEngine") -> str | None:
+    async with engine.connect() as connection:
+        return await connection.run_sync(_get_current_revision)
+
+
+@contextlib.asynccontextmanager
+async def _lock(engine: "AsyncEngine") -> AsyncIterator[None]:
+    """Let one process at a time migrate the database.
+
+    The lock is polled from a connection outside of transactions, because
+    a waiting transaction would block `CREATE INDEX CONCURRENTLY` of the
+    process holding the lock.
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    async with engine.connect() as connection:
+        await connection.execution_options(isolation_level="AUTOCOMMIT")
+        while True:
+            if await connection.scalar(select(func.pg_try_advisory_lock(LOCK_ID))):
+                break
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            await connection.execute(select(func.pg_advisory_unlock(LOCK_ID)))
+
+
+async def upgrade(engine: "AsyncEngine", revision: str = "head") -> None:
+    """Apply pending migrations, even if several processes do it at once."""
+    async with _lock(engine), engine.connect() as connection:
+        await connection.run_sync(_upgrade, revision)
@@ -0,0 +1,12 @@
+from alembic import context
+
+from travel_agent.models import Base
+
+context.configure(
+    connection=context.config.attributes["connection"],
+    target_metadata=Base.metadata,
+    transaction_per_migration=True,
+)
+
+with context.begin_transaction():
+    context.run_migrations()
@@ -0,0 +1,117 @@
+"""Initial schema.
+
+Revision ID: 0001
+Revises:
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "interest",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_interest")),
+        sa.UniqueConstraint("id", name=op.f("uq_interest_id")),
+        sa.UniqueConstraint("name", name=op.f("uq_interest_name")),
+    )
+    op.create_table(
+        "user",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("age", sa.Integer(), nullable=True),
+        sa.Column("sex", sa.Enum("male", "female", name="sexenum"), nullable=True),
+        sa.Column("country", sa.String(), nullable=True),
+        sa.Column("city", sa.String(), nullable=True),
+        sa.Column("bio", sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_user")),
+        sa.UniqueConstraint("id", name=op.f("uq_user_id")),
+    )
+    op.create_table(
+        "travel",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("bio", sa.String(), nullable=True),
+        sa.Column("is_deleted", sa.Boolean(), nullable=False),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_travel")),
+        sa.UniqueConstraint("id", name=op.f("uq_travel_id")),
+        sa.UniqueConstraint("name", name=op.f("uq_travel_name")),
+    )
+    op.create_table(
+        "user_to_interest",
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("interest_id", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["interest_id"],
+            ["interest.id"],
+            name=op.f("fk_user_to_interest_interest_id_interest"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["user.id"], name=op.f("fk_user_to_interest_user_id_user")
+        ),
+        sa.PrimaryKeyConstraint(
+            "user_id", "interest_id", name=op.f("pk_user_to_interest")
+        ),
+    )
+    op.create_table(
+        "user_to_travel",
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("travel_id", sa.BigInteger(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["travel_id"],
+            ["travel.id"],
+            name=op.f("fk_user_to_travel_travel_id_travel"),
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["user.id"], name=op.f("fk_user_to_travel_user_id_user")
+        ),
+        sa.PrimaryKeyConstraint("user_id", "travel_id", name=op.f("pk_user_to_travel")),
+    )
+    op.create_table(
+        "location",
+        sa.Column("id", sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column("travel_id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("lat", sa.Float(), nullable=False),
+        sa.Column("lon", sa.Float(), nullable=False),
+        sa.Column("start_at", sa.Date(), nullable=False),
+        sa.Column("end_at", sa.Date(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["travel_id"], ["travel.id"], name=op.f("fk_location_travel_id_travel")
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_location")),
+        sa.UniqueConstraint("id", name=op.f("uq_location_id")),
+    )
+    op.create_table(
+        "note",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("user_id", sa.BigInteger(), nullable=False),
+        sa.Column("travel_id", sa.BigInteger(), nullable=False),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("is_private", sa.Boolean(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["travel_id"], ["travel.id"], name=op.f("fk_note_travel_id_travel")
+        ),
+        sa.ForeignKeyConstraint(
+            ["user_id"], ["user.id"], name=op.f("fk_note_user_id_user")
+        ),
+        sa.PrimaryKeyConstraint("id", name=op.f("pk_note")),
+        sa.UniqueConstraint("id", name=op.f("uq_note_id")),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("note")
+    op.drop_table("location")
+    op.drop_table("user_to_travel")
+    op.drop_table("user_to_interest")
+    op.drop_table("travel")
+    op.drop_table("user")
+    op.drop_table("interest")
+    sa.Enum(name="sexenum").drop(op.get_bind())
@@ -0,0 +1,53 @@
+"""Index foreign keys and the filters of list queries.
+
+Revision ID: 0002
+Revises: 0001
+"""
+
+from alembic import op
+from sqlalchemy import text
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ("ix_location_travel_id", "location", ["travel_id"], {}),
+    ("ix_note_user_id", "note", ["user_id"], {}),
+    (
+        "ix_note_travel_id_is_private_user_id",
+        "note",
+        ["travel_id", "is_private", "user_id"],
+        {},
+    ),
+    (
+        "ix_travel_id_not_deleted",
+        "travel",
+        ["id"],
+        {"postgresql_where": text("NOT is_deleted")},
+    ),
+    ("ix_user_to_interest_interest_id", "user_to_interest", ["interest_id"], {}),
+    ("ix_user_to_travel_travel_id", "user_to_travel", ["travel_id"], {}),
+)
+
+
+def upgrade() -> None:
+    # Build indexes without blocking writes to the tables. Some of them may
+    # already exist in databases created with `create_all`.
+    with op.get_context().autocommit_block():
+        for name, table, columns, kwargs in INDEXES:
+            op.create_index(
+                name,
+                table,
+                columns,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+                **kwargs,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table, postgresql_concurrently=True)
@@ -0,0 +1,24 @@
+"""Store geocoded home coordinates of users.
+
+Revision ID: 0003
+Revises: 0002
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Nullable columns without defaults don't rewrite the table.
+    op.add_column("user", sa.Column("home_lat", sa.Float(), nullable=True))
+    op.add_column("user", sa.Column("home_lon", sa.Float(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column("user", "home_lon")
+    op.drop_column("user", "home_lat")
@@ -0,0 +1,52 @@
+"""Serve travel lists from a covering index.
+
+The partial index on travel(id) duplicated the primary key. Including
+the name lets travel lists skip reading the table.
+
+Revision ID: 0004
+Revises: 0003
+"""
+
+from alembic import op
+from sqlalchemy import text
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_travel_id_name_not_deleted",
+            "travel",
+            ["id"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+            postgresql_include=["name"],
+            postgresql_where=text("NOT is_deleted"),
+        )
+        op.drop_index(
+            "ix_travel_id_not_deleted",
+            "travel",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_travel_id_not_deleted",
+            "travel",
+            ["id"],
+            if_not_exists=True,
+            postgresql_concurrently=True,
+            postgresql_where=text("NOT is_deleted"),
+        )
+        op.drop_index(
+            "ix_travel_id_name_not_deleted",
+            "travel",
+            postgresql_concurrently=True,
+        )
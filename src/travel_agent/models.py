@@ -7,7 +7,9 @@ from sqlalchemy import (
     Column,
     Enum,
     ForeignKey,
+    Index,
     Table,
+    text,
 )
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
@@ -20,14 +22,14 @@ user_to_interest_table = Table(
     "user_to_interest",
     Base.metadata,
     Column("user_id", ForeignKey("user.id"), primary_key=True),
-    Column("interest_id", ForeignKey("interest.id"), primary_key=True),
+    Column("interest_id", ForeignKey("interest.id"), primary_key=True, index=True),
 )
 
 user_to_travel_table = Table(
     "user_to_travel",
     Base.metadata,
     Column("user_id", ForeignKey("user.id"), primary_key=True),
-    Column("travel_id", ForeignKey("travel.id"), primary_key=True),
+    Column("travel_id", ForeignKey("travel.id"), primary_key=True, index=True),
 )
 
 
@@ -52,21 +54,26 @@ class User(Base):
     country: Mapped[str | None]
     city: Mapped[str | None]
     bio: Mapped[str | None]
+    # Geocoded city, where routes start from.
+    home_lat: Mapped[float | None]
+    home_lon: Mapped[float | None]
 
     travels: Mapped[list["Travel"]] = relationship(
         secondary=user_to_travel_table,
         back_populates="users",
-        lazy="selectin",
+        lazy="raise",
         order_by="asc(Travel.id)",
     )
-    interests: Mapped[set[Interest]] = relationship(secondary=user_to_interest_table)
+    interests: Mapped[set[Interest]] = relationship(
+        secondary=user_to_interest_table, lazy="raise"
+    )
 
 
 class Location(Base):
     id: Mapped[int] = mapped_column(
         BigInteger(), primary_key=True, unique=True, autoincrement=True
     )
-    travel_id: Mapped[int] = mapped_column(ForeignKey("travel.id"))
+    travel_id: Mapped[int] = mapped_column(ForeignKey("travel.id"), index=True)
     name: Mapped[str]
     lat: Mapped[float]
     lon: Mapped[float]
@@ -75,14 +82,33 @@ class Location(Base):
 
 
 class Note(Base):
+    __table_args__ = (
+        # Note lists filter notes by visibility within a travel. This also
+        # serves lookups by travel_id alone.
+        Index(
+            "ix_note_travel_id_is_private_user_id", "travel_id", "is_private", "user_id"
+        ),
+    )
+
     id: Mapped[str] = mapped_column(primary_key=True, unique=True)
-    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"))
+    user_id: Mapped[int] = mapped_column(ForeignKey("user.id"), index=True)
     travel_id: Mapped[int] = mapped_column(ForeignKey("travel.id"))
     name: Mapped[str]
     is_private: Mapped[bool] = mapped_column(default=True)
 
 
 class Travel(Base):
+    __table_args__ = (
+        # Travel lists only show names of travels that aren't deleted, so
+        # they are read from this index alone.
+        Index(
+            "ix_travel_id_name_not_deleted",
+            "id",
+            postgresql_include=["name"],
+            postgresql_where=text("NOT is_deleted"),
+        ),
+    )
+
     id: Mapped[int] = mapped_column(
         BigInteger(), primary_key=True, unique=True, autoincrement=True
     )
@@ -90,10 +116,11 @@ class Travel(Base):
     bio: Mapped[str | None]
     is_deleted: Mapped[bool] = mapped_column(default=False)
 
+    # Relationships are loaded explicitly by repository queries.
     locations: Mapped[list[Location]] = relationship(
-        lazy="selectin", order_by="asc(Location.start_at)"
+        lazy="raise", order_by="asc(Location.start_at)"
     )
-    notes: Mapped[list[Note]] = relationship(lazy="selectin")
+    notes: Mapped[list[Note]] = relationship(lazy="raise")
     users: Mapped[list[User]] = relationship(
-        secondary=user_to_travel_table, back_populates="travels", lazy="selectin"
+        secondary=user_to_travel_table, back_populates="travels", lazy="raise"
     )
@@ -0,0 +1,95 @@
+import asyncio
+import contextlib
+import logging
+import typing
+from collections import Counter
+from dataclasses import dataclass
+
+from telegram.error import BadRequest, NetworkError, TelegramError
+from telegram.ext import ExtBot
+
+from travel_agent.rate_limit import BROADCAST_PRIORITY
+
+logger = logging.getLogger(__name__)
+
+SEND_ATTEMPTS: typing.Final = 3
+
+
+@dataclass(frozen=True)
+class Notification:
+    chat_id: int
+    text: str
+
+
+class NotificationDispatcher:
+    """Sends messages in the background and concurrently.
+
+    Rate limits and flood control are left to the bot's rate limiter, which
+    lets interactive replies go ahead of notifications. Messages are retried
+    after network errors, up to `SEND_ATTEMPTS` times. Other errors, e.g. when
+    a chat is not found or a user has blocked the bot, drop the message
+    without affecting the others.
+    """
+
+    def __init__(self: typing.Self, bot: ExtBot, workers: int) -> None:
+        self.bot = bot
+        self.workers = workers
+        self.stats: Counter[str] = Counter()
+        self._queue: asyncio.Queue[Notification] = asyncio.Queue()
+        self._tasks: list[asyncio.Task[None]] = []
+
+    def notify(self: typing.Self, chat_id: int, text: str) -> None:
+        self._queue.put_nowait(Notification(chat_id=chat_id, text=text))
+
+    def start(self: typing.Self) -> None:
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self: typing.Self, grace_period: float) -> None:
+        """Send the queued messages for up to `grace_period` seconds and stop."""
+        with contextlib.suppress(TimeoutError):
+            await asyncio.wait_for(self._queue.join(), grace_period)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if not self._queue.empty():
+            logger.warning("Dropped %d notifications", self._queue.qsize())
+
+    async def _work(self: typing.Self) -> None:
+        while True:
+            notification = await self._queue.get()
+            try:
+                await self._send(notification)
+            except TelegramError as e:
+                self.stats["failed"] += 1
+                logger.warning(
+                    "Couldn't send notification to %d: %s", notification.chat_id, e
+                )
+            except Exception:
+                # Keep the worker alive.
+                self.stats["failed"] += 1
+                logger.exception(
+                    "Couldn't send notification to %d", notification.chat_id
+                )
+            else:
+                self.stats["sent"] += 1
+            finally:
+                self._queue.task_done()
+
+    async def _send(self: typing.Self, notification: Notification) -> None:
+        for attempt in range(1, SEND_ATTEMPTS + 1):
+            try:
+                await self.bot.send_message(
+                    notification.chat_id,
+                    notification.text,
+                    rate_limit_args=BROADCAST_PRIORITY,
+                )
+            except BadRequest:
+                # A subclass of NetworkError, but retrying won't help.
+                raise
+            except NetworkError:
+                if attempt == SEND_ATTEMPTS:
+                    raise
+                self.stats["retried"] += 1
+                await asyncio.sleep(attempt)
+            else:
+                return
@@ -0,0 +1,222 @@
+import asyncio
+import math
+import pickle
+import typing
+from collections import defaultdict
+from datetime import timedelta
+
+from cachetools import TTLCache
+from redis.asyncio import ConnectionPool, Redis
+from telegram import Update
+from telegram.ext import (
+    BasePersistence,
+    ConversationHandler,
+    PersistenceInput,
+    TypeHandler,
+)
+
+from travel_agent.context import Context
+
+if typing.TYPE_CHECKING:
+    from telegram.ext._utils.types import CDCData, ConversationDict, ConversationKey
+
+UserData: typing.TypeAlias = dict[typing.Any, typing.Any]
+# A user ID and a field of their hash.
+Field: typing.TypeAlias = tuple[int, str]
+
+USER_DATA_FIELD: typing.Final = "user_data"
+# Marks fields that were last synced longer than `ttl` ago.
+_FORGOTTEN: typing.Final = object()
+
+
+def _dumps(value: object) -> bytes | None:
+    return None if value is None else pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+
+def _conversation_field(name: str, key: "ConversationKey") -> str:
+    return f"conversation:{name}:{':'.join(map(str, key))}"
+
+
+class RedisPersistence(BasePersistence[UserData, UserData, UserData]):
+    """Keeps user_data and conversation states in Redis, in a hash per user.
+
+    Nothing is loaded at startup. A user's hash is read before each of their
+    updates (see `create_refresh_handler`), so any worker can continue their
+    conversation. Changes are written every `update_interval` seconds in one
+    pipeline. Conversations must be per chat and per user, the default.
+    """
+
+    def __init__(
+        self: typing.Self,
+        pool: ConnectionPool,
+        ttl: timedelta,
+        update_interval: float,
+    ) -> None:
+        super().__init__(
+            store_data=PersistenceInput(
+                bot_data=False, chat_data=False, user_data=True, callback_data=False
+            ),
+            update_interval=update_interval,
+        )
+        self.client = Redis(connection_pool=pool)
+        self.ttl = ttl
+        # Values last read from or written to Redis. Local values that differ
+        # haven't been written yet and must not be overwritten by a refresh.
+        # Values of idle users are forgotten together with their Redis keys.
+        self._synced: TTLCache[Field, bytes | None] = TTLCache(
+            maxsize=math.inf, ttl=ttl.total_seconds()
+        )
+        self._pending: dict[Field, bytes | None] = {}
+        self._write_task: asyncio.Task[None] | None = None
+
+    @staticmethod
+    def _key(user_id: int) -> str:
+        return f"persistence:{user_id}"
+
+    async def refresh(self: typing.Self, update: Update, context: Context) -> None:
+        user = update.effective_user
+        if user is None:
+            return
+        stored = {
+            field.decode(): value
+            for field, value in (await self.client.hgetall(self._key(user.id))).items()
+        }
+
+        user_data = context.user_data
+        if self._is_synced((user.id, USER_DATA_FIELD), user_data or None):
+            self._synced[user.id, USER_DATA_FIELD] = stored.get(USER_DATA_FIELD)
+            user_data.clear()
+            if USER_DATA_FIELD in stored:
+                user_data.update(pickle.loads(stored[USER_DATA_FIELD]))  # noqa: S301
+
+        if update.effective_chat is None:
+            return
+        key = (update.effective_chat.id, user.id)
+        for handlers in context.application.handlers.values():
+            for handler in handlers:
+                if (
+                    not isinstance(handler, ConversationHandler)
+                    or not handler.persistent
+                ):
+                    continue
+                field = _conversation_field(handler.name, key)
+                # ConversationHandler has no public way to set a state
+                # without marking it as changed.
+                conversations = handler._conversations  # noqa: SLF001
+                if not self._is_synced((user.id, field), conversations.get(key)):
+                    continue
+                self._synced[user.id, field] = stored.get(field)
+                if field in stored:
+                    conversations.update_no_track(
+                        {key: pickle.loads(stored[field])}  # noqa: S301
+                    )
+                else:
+                    conversations.data.pop(key, None)
+
+    def _is_synced(self: typing.Self, field: Field, value: object) -> bool:
+        # Local changes are handed over within `update_interval`, long before
+        # their field is forgotten.
+        synced = self._synced.get(field, _FORGOTTEN)
+        return synced is _FORGOTTEN or synced == _dumps(value)
+
+    async def _write(self: typing.Self, field: Field, value: object) -> None:
+        raw = _dumps(value)
+        if self._synced.get(field) == raw and field not in self._pending:
+            return
+        self._synced[field] = self._pending[field] = raw
+        # The application updates every user and conversation at once, so
+        # their writes are collected into one pipeline.
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write_pending())
+        await self._write_task
+
+    async def _write_pending(self: typing.Self) -> None:
+        await asyncio.sleep(0)
+        self._write_task = None
+        pending, self._pending = self._pending, {}
+
+        fields: defaultdict[int, dict[str, bytes | None]] = defaultdict(dict)
+        for (user_id, field), raw in pending.items():
+            fields[user_id][field] = raw
+        async with self.client.pipeline(transaction=False) as pipeline:
+            for user_id, user_fields in fields.items():
+                key = self._key(user_id)
+                if updated := {f: raw for f, raw in user_fields.items() if raw}:
+                    pipeline.hset(key, mapping=updated)
+                if deleted := [f for f, raw in user_fields.items() if raw is None]:
+                    pipeline.hdel(key, *deleted)
+                pipeline.expire(key, self.ttl)
+            await pipeline.execute()
+
+    async def get_user_data(self: typing.Self) -> dict[int, UserData]:
+        return {}
+
+    async def get_chat_data(self: typing.Self) -> dict[int, UserData]:
+        return {}
+
+    async def get_bot_data(self: typing.Self) -> UserData:
+        return {}
+
+    async def get_callback_data(self: typing.Self) -> "CDCData | None":
+        return None
+
+    async def get_conversations(
+        self: typing.Self,
+        name: str,  # noqa: ARG002
+    ) -> "ConversationDict":
+        return {}
+
+    async def update_conversation(
+        self: typing.Self,
+        name: str,
+        key: "ConversationKey",
+        new_state: object | None,
+    ) -> None:
+        _, user_id = key
+        await self._write((int(user_id), _conversation_field(name, key)), new_state)
+
+    async def update_user_data(self: typing.Self, user_id: int, data: UserData) -> None:
+        await self._write((user_id, USER_DATA_FIELD), data or None)
+
+    async def update_chat_data(self: typing.Self, chat_id: int, data: UserData) -> None:
+        pass
+
+    async def update_bot_data(self: typing.Self, data: UserData) -> None:
+        pass
+
+    async def update_callback_data(self: typing.Self, data: "CDCData") -> None:
+        pass
+
+    async def drop_chat_data(self: typing.Self, chat_id: int) -> None:
+        pass
+
+    async def drop_user_data(self: typing.Self, user_id: int) -> None:
+        await self._write((user_id, USER_DATA_FIELD), None)
+
+    async def refresh_user_data(
+        self: typing.Self, user_id: int, user_data: UserData
+    ) -> None:
+        # Refreshed together with conversations, before handlers are checked.
+        pass
+
+    async def refresh_chat_data(
+        self: typing.Self, chat_id: int, chat_data: UserData
+    ) -> None:
+        pass
+
+    async def refresh_bot_data(self: typing.Self, bot_data: UserData) -> None:
+        pass
+
+    async def flush(self: typing.Self) -> None:
+        if self._write_task is not None:
+            await self._write_task
+        await self.client.aclose()
+
+
+def create_refresh_handler(persistence: RedisPersistence) -> TypeHandler:
+    """Handler to add before every other group, to load the user's state."""
+
+    async def refresh(update: Update, context: Context) -> None:
+        await persistence.refresh(update, context)
+
+    return TypeHandler(Update, refresh)
@@ -0,0 +1,192 @@
+import asyncio
+import heapq
+import itertools
+import time
+import typing
+from collections.abc import Callable, Coroutine
+from dataclasses import dataclass
+
+from cachetools import TTLCache
+from redis.asyncio import Redis
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+# Priorities of Bot API calls, lower goes first.
+INTERACTIVE_PRIORITY: typing.Final = 0
+BROADCAST_PRIORITY: typing.Final = 10
+
+RETRY_AFTER_ATTEMPTS: typing.Final = 3
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second with bursts up to `capacity`.
+
+    Waiters with a lower priority go first, in order of arrival within the
+    same priority.
+    """
+
+    def __init__(self: typing.Self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._waiters: list[tuple[int, int, asyncio.Future[None]]] = []
+        self._counter = itertools.count()
+        self._drainer: asyncio.Task[None] | None = None
+
+    def _refill(self: typing.Self) -> None:
+        now = time.monotonic()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._updated_at) * self.rate
+        )
+        self._updated_at = now
+
+    async def acquire(self: typing.Self, priority: int = INTERACTIVE_PRIORITY) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        if self._drainer is None:
+            self._drainer = asyncio.create_task(self._drain())
+        await future
+
+    async def _drain(self: typing.Self) -> None:
+        try:
+            while self._waiters:
+                self._refill()
+                if self._tokens < 1:
+                    await asyncio.sleep((1 - self._tokens) / self.rate)
+                    continue
+                _, _, future = heapq.heappop(self._waiters)
+                # Cancelled waiters don't take a token.
+                if not future.done():
+                    self._tokens -= 1
+                    future.set_result(None)
+        finally:
+            self._drainer = None
+
+
+class RedisThrottle:
+    """Spaces acquisitions by `interval` seconds across processes.
+
+    The slot is a Redis key that expires after `interval`. Within a process,
+    waiters take turns in order of arrival.
+    """
+
+    def __init__(self: typing.Self, client: Redis, key: str, interval: float) -> None:
+        self.client = client
+        self.key = key
+        self.interval_ms = max(1, round(interval * 1000))
+        self._lock = asyncio.Lock()
+
+    async def acquire(self: typing.Self) -> None:
+        async with self._lock:
+            while not await self.client.set(self.key, 1, nx=True, px=self.interval_ms):
+                # Another process took the slot, wait until it's free.
+                ttl_ms = await self.client.pttl(self.key)
+                await asyncio.sleep(max(ttl_ms, 1) / 1000)
+
+
+@dataclass
+class RateLimiterStats:
+    calls: int = 0
+    # Calls waiting for their turn right now.
+    queued: int = 0
+    max_queued: int = 0
+    wait_time: float = 0.0
+    max_wait_time: float = 0.0
+    retries: int = 0
+
+    @property
+    def average_wait_time(self: typing.Self) -> float:
+        return self.wait_time / self.calls if self.calls else 0.0
+
+
+class RateLimiter(BaseRateLimiter[int]):
+    """Keeps Bot API calls within Telegram's limits, per chat and overall.
+
+    `rate_limit_args` is the priority of a call, `INTERACTIVE_PRIORITY` by
+    default. When Telegram asks to retry after some time, all calls wait for
+    it and the call is retried.
+    """
+
+    def __init__(
+        self: typing.Self,
+        *,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+        group_rate: float,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.stats = RateLimiterStats()
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        # Buckets of idle chats are full, so they can be forgotten.
+        self._chat_buckets: TTLCache[int | str, TokenBucket] = TTLCache(
+            maxsize=10000, ttl=60
+        )
+        self._paused_until = 0.0
+
+    async def initialize(self: typing.Self) -> None:
+        pass
+
+    async def shutdown(self: typing.Self) -> None:
+        pass
+
+    def _chat_bucket(self: typing.Self, chat_id: int | str) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # Group chats have IDs below zero and a lower limit.
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(
+                self.group_rate if is_group else self.chat_rate, self.chat_burst
+            )
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_turn(
+        self: typing.Self, chat_id: int | str | None, priority: int
+    ) -> None:
+        started_at = time.monotonic()
+        self.stats.queued += 1
+        self.stats.max_queued = max(self.stats.max_queued, self.stats.queued)
+        try:
+            if (delay := self._paused_until - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            if chat_id is not None:
+                await self._chat_bucket(chat_id).acquire(priority)
+            await self._global_bucket.acquire(priority)
+        finally:
+            self.stats.queued -= 1
+        wait_time = time.monotonic() - started_at
+        self.stats.wait_time += wait_time
+        self.stats.max_wait_time = max(self.stats.max_wait_time, wait_time)
+
+    async def process_request(  # noqa: PLR0913, PLR0917
+        self: typing.Self,
+        callback: Callable[..., Coroutine[typing.Any, typing.Any, typing.Any]],
+        args: typing.Any,  # noqa: ANN401
+        kwargs: dict[str, typing.Any],
+        endpoint: str,  # noqa: ARG002
+        data: dict[str, typing.Any],
+        rate_limit_args: int | None,
+    ) -> typing.Any:  # noqa: ANN401
+        priority = INTERACTIVE_PRIORITY if rate_limit_args is None else rate_limit_args
+        self.stats.calls += 1
+        for attempt in range(1, RETRY_AFTER_ATTEMPTS + 1):
+            await self._wait_for_turn(data.get("chat_id"), priority)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt == RETRY_AFTER_ATTEMPTS:
+                    raise
+                self.stats.retries += 1
+                self._paused_until = max(
+                    self._paused_until, time.monotonic() + e.retry_after
+                )
+        return None
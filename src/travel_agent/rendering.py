@@ -0,0 +1,400 @@
+import asyncio
+import contextlib
+import hashlib
+import io
+import math
+import typing
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TypeAlias
+from urllib.parse import urlsplit
+
+import httpx
+from PIL import Image, ImageDraw
+
+from travel_agent.tile_cache import TileCache, TileKey, open_tile_cache
+
+TILE_SIZE: typing.Final = 256
+TILE_FETCH_ATTEMPTS: typing.Final = 3
+MAX_ZOOM: typing.Final = 17
+SIMPLIFY_TOLERANCE: typing.Final = 11
+OSM_TILE_HOST: typing.Final = "tile.openstreetmap.org"
+
+Coordinate: TypeAlias = tuple[float, float]
+
+
+def lon_to_x(lon: float, zoom: int) -> float:
+    if not -180 <= lon <= 180:  # noqa: PLR2004
+        lon = (lon + 180) % 360 - 180
+    return ((lon + 180.0) / 360) * 2**zoom
+
+
+def lat_to_y(lat: float, zoom: int) -> float:
+    if not -90 <= lat <= 90:  # noqa: PLR2004
+        lat = (lat + 90) % 180 - 90
+    lat_rad = math.radians(lat)
+    return (
+        (1 - math.log(math.tan(lat_rad) + 1 / math.cos(lat_rad)) / math.pi)
+        / 2
+        * 2**zoom
+    )
+
+
+def x_to_lon(x: float, zoom: int) -> float:
+    return x / 2**zoom * 360.0 - 180.0
+
+
+def y_to_lat(y: float, zoom: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / 2**zoom))))
+
+
+@dataclass(frozen=True)
+class Style:
+    line_color: str = "blue"
+    line_width: int = 3
+    marker_color: str = "blue"
+    marker_width: int = 10
+
+
+@dataclass(frozen=True)
+class ImageEncoding:
+    image_format: str = "png"
+    quality: int = 85
+    optimize: bool = True
+
+
+@dataclass(frozen=True)
+class Viewport:
+    width: int
+    height: int
+    zoom: int
+    x_center: float
+    y_center: float
+
+    @classmethod
+    def fit(
+        cls: type[typing.Self],
+        width: int,
+        height: int,
+        line: list[Coordinate],
+        markers: list[Coordinate],
+        marker_width: int,
+    ) -> typing.Self:
+        """Pick the closest zoom at which the line and the markers fit."""
+        if not line and not markers:
+            msg = "cannot render empty map"
+            raise ValueError(msg)
+
+        line_extent = (
+            (
+                min(lon for lon, _ in line),
+                min(lat for _, lat in line),
+                max(lon for lon, _ in line),
+                max(lat for _, lat in line),
+            )
+            if line
+            else None
+        )
+
+        def extent(zoom: int) -> tuple[float, float, float, float]:
+            extents = [line_extent] if line_extent is not None else []
+            # A marker takes `marker_width` pixels around its point.
+            offset = marker_width / TILE_SIZE
+            for lon, lat in markers:
+                x, y = lon_to_x(lon, zoom), lat_to_y(lat, zoom)
+                extents.append(
+                    (
+                        x_to_lon(x - offset, zoom),
+                        y_to_lat(y + offset, zoom),
+                        x_to_lon(x + offset, zoom),
+                        y_to_lat(y - offset, zoom),
+                    )
+                )
+            return (
+                min(e[0] for e in extents),
+                min(e[1] for e in extents),
+                max(e[2] for e in extents),
+                max(e[3] for e in extents),
+            )
+
+        zoom = 0
+        for z in range(MAX_ZOOM, -1, -1):
+            min_lon, min_lat, max_lon, max_lat = extent(z)
+            if (lon_to_x(max_lon, z) - lon_to_x(min_lon, z)) * TILE_SIZE > width:
+                continue
+            if (lat_to_y(min_lat, z) - lat_to_y(max_lat, z)) * TILE_SIZE > height:
+                continue
+            zoom = z
+            break
+
+        min_lon, min_lat, max_lon, max_lat = extent(zoom)
+        return cls(
+            width=width,
+            height=height,
+            zoom=zoom,
+            x_center=lon_to_x((min_lon + max_lon) / 2, zoom),
+            y_center=lat_to_y((min_lat + max_lat) / 2, zoom),
+        )
+
+    def x_to_px(self: typing.Self, x: float) -> int:
+        return round((x - self.x_center) * TILE_SIZE + self.width / 2)
+
+    def y_to_px(self: typing.Self, y: float) -> int:
+        return round((y - self.y_center) * TILE_SIZE + self.height / 2)
+
+    def to_px(self: typing.Self, coordinate: Coordinate) -> tuple[int, int]:
+        lon, lat = coordinate
+        return (
+            self.x_to_px(lon_to_x(lon, self.zoom)),
+            self.y_to_px(lat_to_y(lat, self.zoom)),
+        )
+
+    def zoomed_out(self: typing.Self) -> typing.Self:
+        return type(self)(
+            width=self.width,
+            height=self.height,
+            zoom=self.zoom - 1,
+            x_center=self.x_center / 2,
+            y_center=self.y_center / 2,
+        )
+
+    def tile_key(self: typing.Self, x: int, y: int) -> TileKey:
+        # x and y may have crossed the date line.
+        max_tile = 2**self.zoom
+        return (self.zoom, x % max_tile, y % max_tile)
+
+    def tiles(self: typing.Self) -> list[tuple[int, int]]:
+        """Tile numbers covering the canvas, not wrapped around the date line."""
+        half_width = 0.5 * self.width / TILE_SIZE
+        half_height = 0.5 * self.height / TILE_SIZE
+        return [
+            (x, y)
+            for x in range(
+                math.floor(self.x_center - half_width),
+                math.ceil(self.x_center + half_width),
+            )
+            for y in range(
+                math.floor(self.y_center - half_height),
+                math.ceil(self.y_center + half_height),
+            )
+        ]
+
+
+def simplify(points: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    if not points:
+        return points
+
+    simplified = [points[0]]
+    for point in points[1:-1]:
+        last = simplified[-1]
+        if math.dist(last, point) > SIMPLIFY_TOLERANCE:
+            simplified.append(point)
+    simplified.append(points[-1])
+    return simplified
+
+
+def is_osm_tile_server(url_template: str) -> bool:
+    """Whether tiles come from the OpenStreetMap servers.
+
+    Their tile usage policy forbids bulk prefetching.
+    """
+    host = urlsplit(url_template).hostname or ""
+    return host == OSM_TILE_HOST or host.endswith(f".{OSM_TILE_HOST}")
+
+
+def compose_map(  # noqa: PLR0913, PLR0917
+    viewport: Viewport,
+    tile_cache_path: Path,
+    tile_cache_max_size: int,
+    line: list[Coordinate],
+    markers: list[Coordinate],
+    style: Style,
+    encoding: ImageEncoding,
+) -> bytes:
+    """Paste the tiles, draw the route and encode the image.
+
+    This is CPU-bound, so it is run in a process pool. Tiles are read
+    straight from the shared tile cache instead of being sent to the worker.
+    """
+    tile_cache = open_tile_cache(tile_cache_path, tile_cache_max_size)
+    image = Image.new("RGB", (viewport.width, viewport.height), "#fff")
+    for x, y in viewport.tiles():
+        blob = tile_cache.open_tile(viewport.tile_key(x, y))
+        if blob is None:
+            # Evicted by another process after prefetching, leave it blank.
+            continue
+        with blob:
+            tile = Image.open(blob).convert("RGBA")
+        image.paste(tile, (viewport.x_to_px(x), viewport.y_to_px(y)), tile)
+
+    # Pillow doesn't antialias lines and circles, so features are drawn
+    # at double size and downscaled.
+    features = Image.new(
+        "RGBA", (viewport.width * 2, viewport.height * 2), (255, 0, 0, 0)
+    )
+    draw = ImageDraw.Draw(features)
+
+    points = simplify([(px * 2, py * 2) for px, py in map(viewport.to_px, line)])
+    width = style.line_width
+    for px, py in points:
+        # Round the joints between segments.
+        draw.ellipse(
+            (px - width + 1, py - width + 1, px + width - 1, py + width - 1),
+            fill=style.line_color,
+        )
+    draw.line(points, fill=style.line_color, width=width * 2)
+
+    width = style.marker_width
+    for px, py in map(viewport.to_px, markers):
+        draw.ellipse(
+            (px * 2 - width, py * 2 - width, px * 2 + width, py * 2 + width),
+            fill=style.marker_color,
+        )
+
+    features = features.resize(
+        (viewport.width, viewport.height), Image.Resampling.LANCZOS
+    )
+    image.paste(features, (0, 0), features)
+
+    with io.BytesIO() as fp:
+        image.save(
+            fp,
+            format=encoding.image_format,
+            optimize=encoding.optimize,
+            quality=encoding.quality,
+        )
+        return fp.getvalue()
+
+
+class TileSource:
+    """Downloads tiles into the tile cache with the shared HTTP client.
+
+    At most `max_downloads` tiles are downloaded at once, as tile servers
+    ask of their users.
+    """
+
+    def __init__(
+        self: typing.Self,
+        client: httpx.AsyncClient,
+        cache: TileCache,
+        url_template: str,
+        user_agent: str,
+        *,
+        max_downloads: int = 2,
+    ) -> None:
+        self.client = client
+        self.cache = cache
+        self.url_template = url_template
+        self.headers = {"User-Agent": user_agent}
+        self._downloads = asyncio.Semaphore(max_downloads)
+
+    async def prefetch(self: typing.Self, viewport: Viewport) -> None:
+        keys = {viewport.tile_key(x, y) for x, y in viewport.tiles()}
+        missing = await asyncio.to_thread(self.cache.missing, keys)
+        if not missing:
+            return
+        contents = await asyncio.gather(*(self._get_tile(key) for key in missing))
+        await asyncio.to_thread(
+            self.cache.put_many, list(zip(missing, contents, strict=True))
+        )
+
+    async def _get_tile(self: typing.Self, key: TileKey) -> bytes:
+        zoom, x, y = key
+        url = self.url_template.format(z=zoom, x=x, y=y)
+        for _ in range(TILE_FETCH_ATTEMPTS - 1):
+            with contextlib.suppress(httpx.HTTPError):
+                return await self._download(url)
+        return await self._download(url)
+
+    async def _download(self: typing.Self, url: str) -> bytes:
+        async with self._downloads:
+            response = await self.client.get(url, headers=self.headers)
+        response.raise_for_status()
+        return response.content
+
+
+class MapRenderer:
+    """Renders routes over raster tiles without blocking the event loop.
+
+    Tiles come from `tiles`; compositing and encoding happen in `executor`.
+    """
+
+    def __init__(
+        self: typing.Self,
+        tiles: TileSource,
+        executor: Executor,
+        encoding: ImageEncoding,
+    ) -> None:
+        self.tiles = tiles
+        self.executor = executor
+        self.encoding = encoding
+
+    def fingerprint(
+        self: typing.Self,
+        waypoints: list[Coordinate],
+        width: int = 1024,
+        height: int = 1024,
+        style: Style = Style(),  # noqa: B008
+    ) -> str:
+        """Identify the image of a route through `waypoints`.
+
+        The route itself is derived from the waypoints, so together with
+        the render parameters they determine the image.
+        """
+        params = (
+            self.tiles.url_template,
+            width,
+            height,
+            style,
+            self.encoding,
+            [(round(lon, 5), round(lat, 5)) for lon, lat in waypoints],
+        )
+        return hashlib.blake2b(repr(params).encode(), digest_size=16).hexdigest()
+
+    async def render(
+        self: typing.Self,
+        line: list[Coordinate],
+        markers: list[Coordinate],
+        width: int = 1024,
+        height: int = 1024,
+        style: Style = Style(),  # noqa: B008
+    ) -> bytes:
+        viewport = Viewport.fit(width, height, line, markers, style.marker_width)
+        await self.tiles.prefetch(viewport)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            compose_map,
+            viewport,
+            self.tiles.cache.path,
+            self.tiles.cache.max_size,
+            line,
+            markers,
+            style,
+            self.encoding,
+        )
+
+
+async def warm_up(
+    tiles: TileSource,
+    bounds: list[tuple[float, float, float, float]],
+    zoom_levels: int,
+    width: int = 1024,
+    height: int = 1024,
+) -> int:
+    """Prefetch tiles around bounding boxes, from the zoom that fits them out.
+
+    Returns the number of viewports prefetched.
+    """
+    count = 0
+    for min_lon, min_lat, max_lon, max_lat in bounds:
+        viewport = Viewport.fit(
+            width, height, [(min_lon, min_lat), (max_lon, max_lat)], [], 0
+        )
+        for _ in range(zoom_levels):
+            await tiles.prefetch(viewport)
+            count += 1
+            if viewport.zoom == 0:
+                break
+            viewport = viewport.zoomed_out()
+    return count
@@ -1,46 +1,492 @@
+import asyncio
+import base64
+import hashlib
+import itertools
+import json
 import secrets
 import typing
-from dataclasses import dataclass
-from datetime import timedelta
+from array import array
+from collections.abc import Sequence
+from dataclasses import astuple, dataclass
+from datetime import date, timedelta
+from typing import Generic, TypeVar
 
 import httpx
 from advanced_alchemy import SQLAlchemyAsyncRepository
 from redis.asyncio import Redis
-from sqlalchemy import insert
+from sqlalchemy import (
+    ColumnElement,
+    Row,
+    Select,
+    exists,
+    func,
+    insert,
+    or_,
+    select,
+    update,
+)
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
-from travel_agent.models import Location, Note, Travel, User, user_to_travel_table
+from travel_agent.cache import VersionedCache
+from travel_agent.models import (
+    Location,
+    Note,
+    SexEnum,
+    Travel,
+    User,
+    user_to_travel_table,
+)
+
+if typing.TYPE_CHECKING:
+    from travel_agent.geocoding import Geocoder
+
+T = TypeVar("T")
+K = TypeVar("K")
+
+
+@dataclass
+class Page(Generic[T]):
+    items: Sequence[T]
+    has_prev: bool
+    has_next: bool
+
+
+async def paginate(  # noqa: PLR0913, PLR0917
+    session: AsyncSession,
+    stmt: Select[typing.Any],
+    key: ColumnElement[K],
+    after: K | None,
+    before: K | None,
+    limit: int,
+) -> Page[Row[typing.Any]]:
+    """Keyset pagination of `stmt` over the unique `key`.
+
+    Returns the page after `after` or, if given, before `before`. One extra
+    row is fetched to tell whether there is another page in that direction.
+    """
+    stmt = stmt.limit(limit + 1)
+    if before is not None:
+        stmt = stmt.where(key < before).order_by(key.desc())
+    else:
+        if after is not None:
+            stmt = stmt.where(key > after)
+        stmt = stmt.order_by(key)
+
+    result = await session.execute(stmt)
+    rows = result.all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before is not None:
+        return Page(items=rows[::-1], has_prev=has_more, has_next=True)
+    return Page(items=rows, has_prev=after is not None, has_next=has_more)
+
+
+# Columns of the profile shown in settings.
+PROFILE_COLUMNS: typing.Final = (User.age, User.sex, User.city, User.country, User.bio)
+
+
+@dataclass(frozen=True)
+class Profile:
+    age: int | None
+    sex: SexEnum | None
+    city: str | None
+    country: str | None
+    bio: str | None
+
+
+def dump_profile(profile: Profile) -> bytes:
+    return json.dumps(astuple(profile)).encode()
+
+
+def load_profile(raw: bytes) -> Profile:
+    age, sex, city, country, bio = json.loads(raw)
+    return Profile(age, sex and SexEnum(sex), city, country, bio)
 
 
 class UserRepository(SQLAlchemyAsyncRepository[User]):
+    """Users, with their profiles cached in `profile_cache` if it is given.
+
+    Writes must be committed by the repository, to invalidate the cache.
+    """
+
     model_type = User
 
+    def __init__(
+        self: typing.Self,
+        *,
+        profile_cache: VersionedCache[Profile] | None = None,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(**kwargs)
+        self.profile_cache = profile_cache
+
+    async def update(
+        self: typing.Self,
+        data: User,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> User:
+        # The updated instance is expired after a commit.
+        user_id = data.id
+        user = await super().update(data, **kwargs)
+        if self.profile_cache is not None:
+            await self.profile_cache.invalidate(str(user_id))
+        return user
+
+    async def get_profile(self: typing.Self, user_id: int) -> Profile:
+        version = 0
+        if self.profile_cache is not None:
+            profile, version = await self.profile_cache.get(str(user_id))
+            if profile is not None:
+                return profile
+
+        stmt = select(*PROFILE_COLUMNS).where(User.id == user_id)
+        profile = Profile(*(await self.session.execute(stmt)).one())
+        if self.profile_cache is not None:
+            await self.profile_cache.set(str(user_id), version, profile)
+        return profile
+
+    async def update_profile(
+        self: typing.Self, user_id: int, **values: object
+    ) -> Profile:
+        """Set some columns of the user and return the updated profile."""
+        stmt = (
+            update(User)
+            .where(User.id == user_id)
+            .values(**values)
+            .returning(*PROFILE_COLUMNS)
+        )
+        profile = Profile(*(await self.session.execute(stmt)).one())
+        await self._flush_or_commit(auto_commit=None)
+        if self.profile_cache is not None:
+            await self.profile_cache.invalidate(str(user_id), profile)
+        return profile
+
+    async def ensure_exists(self: typing.Self, user_id: int) -> None:
+        stmt = (
+            postgresql.insert(User)
+            .values(id=user_id)
+            .on_conflict_do_nothing(index_elements=[User.id])
+        )
+        await self.session.execute(stmt)
+        await self._flush_or_commit(auto_commit=None)
+
+    async def list_without_home(self: typing.Self) -> Sequence[User]:
+        """Users with a city and a country that haven't been geocoded."""
+        return await self.list(
+            User.city.is_not(None), User.country.is_not(None), User.home_lat.is_(None)
+        )
+
+
+@dataclass(frozen=True)
+class LocationHeader:
+    name: str
+    lat: float
+    lon: float
+    start_at: date
+    end_at: date
+
+
+@dataclass(frozen=True)
+class TravelHeader:
+    """What the travel menu shows: the travel and its locations in order."""
+
+    id: int
+    name: str
+    bio: str | None
+    locations: tuple[LocationHeader, ...]
+
+
+def dump_travel_header(travel: TravelHeader) -> bytes:
+    return json.dumps(
+        [
+            travel.id,
+            travel.name,
+            travel.bio,
+            [
+                [
+                    location.name,
+                    location.lat,
+                    location.lon,
+                    location.start_at.isoformat(),
+                    location.end_at.isoformat(),
+                ]
+                for location in travel.locations
+            ],
+        ]
+    ).encode()
+
+
+def load_travel_header(raw: bytes) -> TravelHeader:
+    travel_id, name, bio, locations = json.loads(raw)
+    return TravelHeader(
+        id=travel_id,
+        name=name,
+        bio=bio,
+        locations=tuple(
+            LocationHeader(
+                name=name,
+                lat=lat,
+                lon=lon,
+                start_at=date.fromisoformat(start_at),
+                end_at=date.fromisoformat(end_at),
+            )
+            for name, lat, lon, start_at, end_at in locations
+        ),
+    )
+
 
 class TravelRepository(SQLAlchemyAsyncRepository[Travel]):
+    """Travels, with their headers cached in `header_cache` if it is given.
+
+    Writes must be committed by the repository, to invalidate the cache.
+    """
+
     model_type = Travel
 
+    def __init__(
+        self: typing.Self,
+        *,
+        header_cache: VersionedCache[TravelHeader] | None = None,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(**kwargs)
+        self.header_cache = header_cache
+
+    async def update(
+        self: typing.Self,
+        data: Travel,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> Travel:
+        # The updated instance is expired after a commit.
+        travel_id = data.id
+        travel = await super().update(data, **kwargs)
+        if self.header_cache is not None:
+            await self.header_cache.invalidate(str(travel_id))
+        return travel
+
+    async def update_travel(
+        self: typing.Self, travel_id: int, **values: object
+    ) -> None:
+        """Set some columns of the travel without loading it."""
+        stmt = update(Travel).where(Travel.id == travel_id).values(**values)
+        await self.session.execute(stmt)
+        await self._flush_or_commit(auto_commit=None)
+        if self.header_cache is not None:
+            await self.header_cache.invalidate(str(travel_id))
+
     async def add_user_to(self: typing.Self, travel_id: int, user_id: int) -> None:
         stmt = insert(user_to_travel_table).values(user_id=user_id, travel_id=travel_id)
         await self.session.execute(stmt)
         await self._flush_or_commit(auto_commit=None)
 
+    async def get_with_locations(self: typing.Self, travel_id: int) -> Travel:
+        return await self.get(
+            travel_id, statement=select(Travel).options(selectinload(Travel.locations))
+        )
+
+    async def get_header(self: typing.Self, travel_id: int) -> TravelHeader:
+        version = 0
+        if self.header_cache is not None:
+            header, version = await self.header_cache.get(str(travel_id))
+            if header is not None:
+                return header
+
+        travel = await self.get_with_locations(travel_id)
+        header = TravelHeader(
+            id=travel.id,
+            name=travel.name,
+            bio=travel.bio,
+            locations=tuple(
+                LocationHeader(
+                    name=location.name,
+                    lat=location.lat,
+                    lon=location.lon,
+                    start_at=location.start_at,
+                    end_at=location.end_at,
+                )
+                for location in travel.locations
+            ),
+        )
+        if self.header_cache is not None:
+            await self.header_cache.set(str(travel_id), version, header)
+        return header
+
+    async def is_member(self: typing.Self, travel_id: int, user_id: int) -> bool:
+        """Whether the user is in the travel and it isn't deleted."""
+        stmt = select(
+            exists().where(
+                user_to_travel_table.c.travel_id == travel_id,
+                user_to_travel_table.c.user_id == user_id,
+                Travel.id == user_to_travel_table.c.travel_id,
+                Travel.is_deleted.is_(False),
+            )
+        )
+        return bool(await self.session.scalar(stmt))
+
+    async def get_member_ids(self: typing.Self, travel_id: int) -> list[int]:
+        stmt = select(user_to_travel_table.c.user_id).where(
+            user_to_travel_table.c.travel_id == travel_id
+        )
+        result = await self.session.scalars(stmt)
+        return list(result)
+
+    async def list_names_by_user(
+        self: typing.Self, user_id: int
+    ) -> Sequence[Row[tuple[int, str]]]:
+        """IDs and names of the user's travels that aren't deleted."""
+        stmt = (
+            select(Travel.id, Travel.name)
+            .join(user_to_travel_table)
+            .where(
+                user_to_travel_table.c.user_id == user_id,
+                Travel.is_deleted.is_(False),
+            )
+            .order_by(Travel.id)
+        )
+        result = await self.session.execute(stmt)
+        return result.all()
+
+    async def page_names_by_user(
+        self: typing.Self,
+        user_id: int,
+        after_id: int | None = None,
+        before_id: int | None = None,
+        limit: int = 10,
+    ) -> Page[Row[tuple[int, str]]]:
+        """Keyset-paginated `list_names_by_user`.
+
+        Returns the page after `after_id` or, if given, before `before_id`.
+        """
+        stmt = (
+            select(Travel.id, Travel.name)
+            .join(user_to_travel_table)
+            .where(
+                user_to_travel_table.c.user_id == user_id,
+                Travel.is_deleted.is_(False),
+            )
+        )
+        return await paginate(
+            self.session,
+            stmt,
+            user_to_travel_table.c.travel_id,
+            after=after_id,
+            before=before_id,
+            limit=limit,
+        )
+
 
 class NoteRepository(SQLAlchemyAsyncRepository[Note]):
     model_type = Note
 
+    async def page_visible(
+        self: typing.Self,
+        travel_id: int,
+        user_id: int,
+        after_id: str | None = None,
+        before_id: str | None = None,
+        limit: int = 10,
+    ) -> Page[Row[tuple[str, str]]]:
+        """IDs and names of the travel's notes that the user may see.
+
+        Public notes are visible to every member, private ones to the author.
+        """
+        stmt = select(Note.id, Note.name).where(
+            Note.travel_id == travel_id,
+            or_(Note.is_private.is_(False), Note.user_id == user_id),
+        )
+        return await paginate(
+            self.session, stmt, Note.id, after=after_id, before=before_id, limit=limit
+        )
+
 
 class LocationRepository(SQLAlchemyAsyncRepository[Location]):
+    """Locations, invalidating the cached headers of their travels."""
+
     model_type = Location
 
+    def __init__(
+        self: typing.Self,
+        *,
+        travel_header_cache: VersionedCache[TravelHeader] | None = None,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> None:
+        super().__init__(**kwargs)
+        self.travel_header_cache = travel_header_cache
+
+    async def add(
+        self: typing.Self,
+        data: Location,
+        **kwargs: typing.Any,  # noqa: ANN401
+    ) -> Location:
+        travel_id = data.travel_id
+        location = await super().add(data, **kwargs)
+        if self.travel_header_cache is not None:
+            await self.travel_header_cache.invalidate(str(travel_id))
+        return location
+
+    async def get_travel_bounds(
+        self: typing.Self,
+    ) -> list[tuple[float, float, float, float]]:
+        """Bounding boxes (min lon, min lat, max lon, max lat) of live travels."""
+        stmt = (
+            select(
+                func.min(Location.lon),
+                func.min(Location.lat),
+                func.max(Location.lon),
+                func.max(Location.lat),
+            )
+            .join(Travel, Travel.id == Location.travel_id)
+            .where(Travel.is_deleted.is_(False))
+            .group_by(Location.travel_id)
+        )
+        result = await self.session.execute(stmt)
+        return [tuple(row) for row in result]
+
 
 class InviteTokenRepository:
-    def __init__(self: typing.Self, client: Redis) -> None:
+    """Invite tokens of travels, each mapped to its travel ID.
+
+    A travel reuses its current token while it is valid for at least
+    `renew_before`, so the same link is shown on every view. All tokens of
+    a travel are indexed, to revoke them when it is deleted.
+    """
+
+    def __init__(
+        self: typing.Self,
+        client: Redis,
+        ttl: timedelta = timedelta(hours=24),
+        renew_before: timedelta = timedelta(hours=12),
+    ) -> None:
         self.client = client
+        self.ttl = ttl
+        self.renew_before = renew_before
+
+    @staticmethod
+    def _current_key(travel_id: int) -> str:
+        return f"invite:travel:{travel_id}"
+
+    @staticmethod
+    def _index_key(travel_id: int) -> str:
+        return f"invite:travel:{travel_id}:all"
 
     async def create(self: typing.Self, travel_id: int) -> str:
-        invite_token: str = secrets.token_urlsafe(6)
-        await self.client.set(
-            name=invite_token, value=travel_id, ex=timedelta(hours=24)
-        )
+        """Current token of the travel, or a new one if it expires soon."""
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.get(self._current_key(travel_id))
+            pipe.ttl(self._current_key(travel_id))
+            token, ttl = await pipe.execute()
+        if token is not None and ttl > self.renew_before.total_seconds():
+            return token.decode()
+
+        invite_token = secrets.token_urlsafe(6)
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.set(invite_token, travel_id, ex=self.ttl)
+            pipe.set(self._current_key(travel_id), invite_token, ex=self.ttl)
+            pipe.sadd(self._index_key(travel_id), invite_token)
+            pipe.expire(self._index_key(travel_id), self.ttl)
+            await pipe.execute()
         return invite_token
 
     async def get_travel_id(self: typing.Self, invite_token: str) -> int | None:
@@ -49,6 +495,78 @@ class InviteTokenRepository:
             result = int(result)
         return result
 
+    async def revoke(self: typing.Self, travel_id: int) -> None:
+        index_key = self._index_key(travel_id)
+        tokens = await self.client.smembers(index_key)
+        await self.client.delete(self._current_key(travel_id), index_key, *tokens)
+
+
+class RouteMapRepository:
+    """Telegram file_ids of already uploaded route maps."""
+
+    def __init__(
+        self: typing.Self, client: Redis, ttl: timedelta = timedelta(days=30)
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    async def get_file_id(self: typing.Self, fingerprint: str) -> str | None:
+        result: bytes | None = await self.client.get(f"route_map:{fingerprint}")
+        if result is None:
+            return None
+        return result.decode()
+
+    async def set_file_id(self: typing.Self, fingerprint: str, file_id: str) -> None:
+        await self.client.set(f"route_map:{fingerprint}", file_id, ex=self.ttl)
+
+
+class CallbackPayloadRepository:
+    """Arguments of inline buttons that don't fit into callback data.
+
+    Keys are derived from the payload, so the same payload gets the same key.
+    """
+
+    def __init__(
+        self: typing.Self, client: Redis, ttl: timedelta = timedelta(days=7)
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    async def put(self: typing.Self, payload: bytes) -> str:
+        digest = hashlib.blake2b(payload, digest_size=6).digest()
+        key = base64.urlsafe_b64encode(digest).decode()
+        await self.client.set(f"callback:{key}", payload, ex=self.ttl)
+        return key
+
+    async def get(self: typing.Self, key: str) -> bytes | None:
+        return await self.client.get(f"callback:{key}")
+
+
+class RenderedMessageRepository:
+    """Digests of what bot messages show, shared by all workers.
+
+    An edit that wouldn't change a message can be skipped, whichever worker
+    rendered it last.
+    """
+
+    def __init__(
+        self: typing.Self, client: Redis, ttl: timedelta = timedelta(days=2)
+    ) -> None:
+        self.client = client
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(chat_id: int, message_id: int) -> str:
+        return f"rendered:{chat_id}:{message_id}"
+
+    async def get(self: typing.Self, chat_id: int, message_id: int) -> bytes | None:
+        return await self.client.get(self._key(chat_id, message_id))
+
+    async def set(
+        self: typing.Self, chat_id: int, message_id: int, digest: bytes
+    ) -> None:
+        await self.client.set(self._key(chat_id, message_id), digest, ex=self.ttl)
+
 
 @dataclass
 class Place:
@@ -58,35 +576,146 @@ class Place:
     address: str
 
 
+def dump_places(places: list[Place]) -> bytes:
+    return json.dumps([astuple(place) for place in places]).encode()
+
+
+def load_places(raw: bytes) -> list[Place]:
+    return [Place(*place) for place in json.loads(raw)]
+
+
 class MapSearchRepository:
-    def __init__(self: typing.Self, client: httpx.AsyncClient) -> None:
-        self.client = client
+    def __init__(self: typing.Self, geocoder: "Geocoder", language: str = "ru") -> None:
+        self.geocoder = geocoder
+        self.language = language
 
     async def search(self: typing.Self, query: str) -> list[Place]:
-        response = await self.client.get(
-            "https://nominatim.openstreetmap.org/search",
-            params={"format": "jsonv2", "q": query},
-            headers={"Accept-Language": "ru"},
-        )
-        if not response.is_success:
-            raise
-        data = response.json()
-        return [
-            Place(
-                lat=float(place["lat"]),
-                lon=float(place["lon"]),
-                name=place["name"],
-                address=place["display_name"],
-            )
-            for place in data
-        ]
+        return await self.geocoder.search(query, self.language)
+
+
+ROUTE_KEY_PRECISION = 5
+
+
+def encode_route(route: list[tuple[float, float]]) -> bytes:
+    return array("f", itertools.chain.from_iterable(route)).tobytes()
+
+
+def decode_route(raw: bytes) -> list[tuple[float, float]]:
+    values = array("f")
+    values.frombytes(raw)
+    return list(zip(values[::2], values[1::2], strict=True))
+
+
+def join_legs(
+    geometries: Sequence[list[tuple[float, float]]],
+) -> list[tuple[float, float]]:
+    route = list(geometries[0])
+    for geometry in geometries[1:]:
+        # Consecutive legs share the waypoint between them.
+        route.extend(geometry[1:])
+    return route
 
 
 class RouteRepository:
-    def __init__(self: typing.Self, client: httpx.AsyncClient) -> None:
+    """Car routes from OSRM.
+
+    A route is requested leg by leg (between consecutive waypoints), so
+    adding a location to a long travel costs only the legs around it.
+    Both legs and assembled routes are cached in Redis.
+    """
+
+    def __init__(
+        self: typing.Self,
+        client: httpx.AsyncClient,
+        cache: Redis,
+        ttl: timedelta = timedelta(days=30),
+        max_concurrent_legs: int = 4,
+    ) -> None:
         self.client = client
+        self.cache = cache
+        self.ttl = ttl
+        self.max_concurrent_legs = max_concurrent_legs
+
+    @staticmethod
+    def _cache_key(prefix: str, points: tuple[tuple[float, float], ...]) -> str:
+        waypoints = ";".join(
+            f"{lon:.{ROUTE_KEY_PRECISION}f},{lat:.{ROUTE_KEY_PRECISION}f}"
+            for lon, lat in points
+        )
+        digest = hashlib.blake2b(waypoints.encode(), digest_size=16).hexdigest()
+        return f"{prefix}:{digest}"
+
+    @staticmethod
+    def _travel_index_key(travel_id: int) -> str:
+        return f"route:travel:{travel_id}"
 
     async def create_car_route(
+        self: typing.Self, *args: tuple[float, float], travel_id: int | None = None
+    ) -> list[tuple[float, float]]:
+        if len(args) < 2:  # noqa: PLR2004
+            return list(args)
+
+        key = self._cache_key("route", args)
+        raw: bytes | None = await self.cache.get(key)
+        if raw is not None:
+            return decode_route(raw)
+
+        legs = list(itertools.pairwise(args))
+        leg_keys = [self._cache_key("route:leg", leg) for leg in legs]
+        geometries: list[list[tuple[float, float]] | None] = [
+            decode_route(raw) if raw is not None else None
+            for raw in await self.cache.mget(leg_keys)
+        ]
+        missing = [i for i, geometry in enumerate(geometries) if geometry is None]
+
+        errors: list[BaseException] = []
+        created: list[int] = []
+        results = await self._create_legs([legs[i] for i in missing])
+        for i, result in zip(missing, results, strict=True):
+            if isinstance(result, BaseException):
+                errors.append(result)
+            else:
+                geometries[i] = result
+                created.append(i)
+        route = None if errors else join_legs(geometries)
+
+        async with self.cache.pipeline(transaction=False) as pipe:
+            # Legs that were routed are kept even if others failed.
+            for i in created:
+                pipe.set(leg_keys[i], encode_route(geometries[i]), ex=self.ttl)
+            if route is not None:
+                pipe.set(key, encode_route(route), ex=self.ttl)
+                if travel_id is not None:
+                    index_key = self._travel_index_key(travel_id)
+                    pipe.sadd(index_key, key)
+                    pipe.expire(index_key, self.ttl)
+            await pipe.execute()
+        if route is None:
+            raise errors[0]
+        return route
+
+    async def _create_legs(
+        self: typing.Self, legs: list[tuple[tuple[float, float], ...]]
+    ) -> list[list[tuple[float, float]] | BaseException]:
+        """Route the legs concurrently, returning the errors of failed ones."""
+        semaphore = asyncio.Semaphore(self.max_concurrent_legs)
+
+        async def create_leg(
+            leg: tuple[tuple[float, float], ...],
+        ) -> list[tuple[float, float]]:
+            async with semaphore:
+                return await self._create_car_route(*leg)
+
+        return await asyncio.gather(
+            *(create_leg(leg) for leg in legs), return_exceptions=True
+        )
+
+    async def invalidate(self: typing.Self, travel_id: int) -> None:
+        index_key = self._travel_index_key(travel_id)
+        keys = await self.cache.smembers(index_key)
+        await self.cache.delete(index_key, *keys)
+
+    async def _create_car_route(
         self: typing.Self, *args: tuple[float, float]
     ) -> list[tuple[float, float]]:
         coordinates = ";".join([f"{arg[0]},{arg[1]}" for arg in args])
@@ -97,6 +726,5 @@ class RouteRepository:
                 "overview": "simplified",
             },
         )
-        if not response.is_success:
-            raise
+        response.raise_for_status()
         return response.json()["routes"][0]["geometry"]["coordinates"]
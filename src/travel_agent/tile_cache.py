@@ -0,0 +1,134 @@
+import functools
+import sqlite3
+import threading
+import time
+import typing
+from collections.abc import Iterable
+from pathlib import Path
+
+TileKey: typing.TypeAlias = tuple[int, int, int]
+
+EVICTION_BATCH: typing.Final = 256
+
+SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS tiles (
+    zoom_level INTEGER NOT NULL,
+    tile_column INTEGER NOT NULL,
+    tile_row INTEGER NOT NULL,
+    tile_data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    accessed_at REAL NOT NULL,
+    UNIQUE (zoom_level, tile_column, tile_row)
+);
+CREATE INDEX IF NOT EXISTS tiles_accessed_at ON tiles (accessed_at, size);
+-- Total size of the tiles, kept up to date by triggers.
+CREATE TABLE IF NOT EXISTS tiles_size (total INTEGER NOT NULL);
+INSERT INTO tiles_size SELECT coalesce(sum(size), 0) FROM tiles
+WHERE NOT EXISTS (SELECT 1 FROM tiles_size);
+CREATE TRIGGER IF NOT EXISTS tiles_size_insert AFTER INSERT ON tiles BEGIN
+    UPDATE tiles_size SET total = total + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tiles_size_update AFTER UPDATE OF size ON tiles BEGIN
+    UPDATE tiles_size SET total = total - old.size + new.size;
+END;
+CREATE TRIGGER IF NOT EXISTS tiles_size_delete AFTER DELETE ON tiles BEGIN
+    UPDATE tiles_size SET total = total - old.size;
+END;
+COMMIT;
+"""
+
+
+class TileCache:
+    """Raster tiles in a SQLite file shared by every process on the host.
+
+    Tiles are keyed by z/x/y (XYZ, not TMS rows) and evicted least recently
+    used first once the total size exceeds `max_size`. The file is
+    memory-mapped, so reading a tile through `open_tile` doesn't copy it.
+    """
+
+    def __init__(self: typing.Self, path: Path, max_size: int) -> None:
+        self.path = path
+        self.max_size = max_size
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode = WAL")
+        self._connection.execute("PRAGMA synchronous = NORMAL")
+        self._connection.execute(f"PRAGMA mmap_size = {int(max_size * 1.5)}")
+        self._connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def missing(self: typing.Self, keys: Iterable[TileKey]) -> list[TileKey]:
+        """Return keys that aren't cached and mark the others as used."""
+        keys = list(keys)
+        with self._lock, self._connection:
+            cursor = self._connection.executemany(
+                "UPDATE tiles SET accessed_at = ? "
+                "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                [(time.time(), *key) for key in keys],
+            )
+            if cursor.rowcount == len(keys):
+                return []
+            return [
+                key
+                for key in keys
+                if self._connection.execute(
+                    "SELECT 1 FROM tiles "
+                    "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    key,
+                ).fetchone()
+                is None
+            ]
+
+    def put_many(self: typing.Self, tiles: Iterable[tuple[TileKey, bytes]]) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            # An upsert rather than INSERT OR REPLACE, whose deletes don't
+            # fire triggers.
+            self._connection.executemany(
+                "INSERT INTO tiles VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (zoom_level, tile_column, tile_row) DO UPDATE SET "
+                "tile_data = excluded.tile_data, size = excluded.size, "
+                "accessed_at = excluded.accessed_at",
+                [(*key, data, len(data), now) for key, data in tiles],
+            )
+            (total,) = self._connection.execute(
+                "SELECT total FROM tiles_size"
+            ).fetchone()
+            self._evict(total - self.max_size)
+
+    def _evict(self: typing.Self, excess: int) -> None:
+        """Delete least recently used tiles of at least `excess` bytes."""
+        while excess > 0:
+            rows = self._connection.execute(
+                "SELECT rowid, size FROM tiles ORDER BY accessed_at LIMIT ?",
+                (EVICTION_BATCH,),
+            ).fetchall()
+            if not rows:
+                return
+            evicted = []
+            for rowid, size in rows:
+                if excess <= 0:
+                    break
+                evicted.append((rowid,))
+                excess -= size
+            self._connection.executemany("DELETE FROM tiles WHERE rowid = ?", evicted)
+
+    def open_tile(self: typing.Self, key: TileKey) -> sqlite3.Blob | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT rowid FROM tiles "
+                "WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                key,
+            ).fetchone()
+            if row is None:
+                return None
+            return self._connection.blobopen(
+                "tiles", "tile_data", row[0], readonly=True
+            )
+
+
+@functools.cache
+def open_tile_cache(path: Path, max_size: int) -> TileCache:
+    """One connection per process, for the rendering workers."""
+    return TileCache(path, max_size)
@@ -0,0 +1,52 @@
+import asyncio
+import contextlib
+import sys
+import typing
+from collections.abc import Awaitable
+from weakref import WeakValueDictionary
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, but one at a time for each user.
+
+    Conversations are keyed by user, so their updates must not race.
+    Waiting updates don't take a slot of `limit`.
+    """
+
+    __slots__ = ("_locks", "_slots", "limit")
+
+    def __init__(self: typing.Self, limit: int) -> None:
+        # The semaphore of the base class is taken before the per-user lock,
+        # so the limit is enforced by `_slots` instead.
+        super().__init__(sys.maxsize)
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._locks: WeakValueDictionary[int, asyncio.Lock] = WeakValueDictionary()
+
+    def _lock_for(
+        self: typing.Self, update: object
+    ) -> contextlib.AbstractAsyncContextManager[typing.Any]:
+        if not isinstance(update, Update) or update.effective_user is None:
+            return contextlib.nullcontext()
+        user_id = update.effective_user.id
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def do_process_update(
+        self: typing.Self, update: object, coroutine: Awaitable[typing.Any]
+    ) -> None:
+        # asyncio.Lock wakes up waiters in order, so a user's updates are
+        # handled in the order they were received.
+        async with self._lock_for(update), self._slots:
+            await coroutine
+
+    async def initialize(self: typing.Self) -> None:
+        pass
+
+    async def shutdown(self: typing.Self) -> None:
+        pass
@@ -1,9 +1,13 @@
 import functools
+import hashlib
+from collections.abc import Callable
 
 import telegram as tg
+from telegram.error import BadRequest
 from telegram.helpers import mention_html
 
 from travel_agent.context import Context
+from travel_agent.repositories import Page
 from travel_agent.types import Callback, CallbackQueryCallback, MessageCallback
 
 
@@ -35,15 +39,49 @@ def get_mention(user: tg.User) -> str:
     return mention_html(user_id=user.id, name=user.name)
 
 
-def check_callback_data(data: object, action: str) -> bool:
-    if isinstance(data, tuple):
-        try:
-            data_action = data[0]
-        except IndexError:
-            return False
-    elif isinstance(data, str):
-        data_action = data
-    else:
-        return False
+def build_page_navigation(
+    page: Page, callback_data: Callable[[str, int], str]
+) -> list[tg.InlineKeyboardButton]:
+    """Buttons to the previous and next pages.
 
-    return data_action == action
+    Their callback data is built from the direction and the index of the
+    boundary item on the page.
+    """
+    navigation = []
+    if page.has_prev and page.items:
+        navigation.append(
+            tg.InlineKeyboardButton("<<", callback_data=callback_data("prev", 0))
+        )
+    if page.has_next and page.items:
+        navigation.append(
+            tg.InlineKeyboardButton(
+                ">>", callback_data=callback_data("next", len(page.items) - 1)
+            )
+        )
+    return navigation
+
+
+async def edit_message(
+    callback_query: tg.CallbackQuery,
+    context: Context,
+    text: str,
+    reply_markup: tg.InlineKeyboardMarkup | None = None,
+) -> None:
+    """Replace the text and the keyboard of the message in one request.
+
+    Nothing is sent if the message already shows them.
+    """
+    message = callback_query.message
+    chat_id, message_id = message.chat.id, message.message_id
+    content = text if reply_markup is None else text + reply_markup.to_json()
+    digest = hashlib.blake2b(content.encode(), digest_size=16).digest()
+    rendered_message_repo = context.rendered_message_repo
+    if await rendered_message_repo.get(chat_id, message_id) == digest:
+        return
+    try:
+        await message.edit_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Rendered before its digest expired.
+        if "message is not modified" not in e.message.lower():
+            raise
+    await rendered_message_repo.set(chat_id, message_id, digest)
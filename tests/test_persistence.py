@@ -0,0 +1,112 @@
+"""RedisPersistence with two applications sharing one Redis.
+
+The sync of conversation states relies on private APIs of
+python-telegram-bot, so this breaks loudly if an upgrade changes them.
+"""
+
+import asyncio
+import typing
+from datetime import timedelta
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+from telegram import Update, User
+from telegram.ext import (
+    Application,
+    CommandHandler,
+    ContextTypes,
+    ConversationHandler,
+    ExtBot,
+    MessageHandler,
+    filters,
+)
+
+from travel_agent.context import Context
+from travel_agent.persistence import RedisPersistence, create_refresh_handler
+
+ASKED: typing.Final = 0
+USER_ID: typing.Final = 42
+
+
+async def ask(_update: Update, context: Context) -> int:
+    context.user_data["asked"] = True
+    return ASKED
+
+
+async def answer(update: Update, context: Context) -> int:
+    context.user_data["answer"] = update.message.text
+    context.bot_data["answers"] += 1
+    return ConversationHandler.END
+
+
+def create_application(server: FakeServer) -> Application:
+    persistence = RedisPersistence(
+        FakeRedis(server=server).connection_pool,
+        ttl=timedelta(hours=1),
+        update_interval=60,
+    )
+    application = (
+        Application.builder()
+        .token("1:token")
+        .persistence(persistence)
+        .context_types(ContextTypes(Context))
+        .build()
+    )
+    application.bot_data["answers"] = 0
+    application.add_handler(create_refresh_handler(persistence), group=-1)
+    application.add_handler(
+        ConversationHandler(
+            entry_points=[CommandHandler("start", ask)],
+            states={ASKED: [MessageHandler(filters.TEXT & ~filters.COMMAND, answer)]},
+            fallbacks=[],
+            name="test",
+            persistent=True,
+        )
+    )
+    return application
+
+
+def message(application: Application, message_id: int, text: str) -> Update:
+    data: dict[str, typing.Any] = {
+        "message_id": message_id,
+        "date": 0,
+        "chat": {"id": USER_ID, "type": "private"},
+        "from": {"id": USER_ID, "is_bot": False, "first_name": "User"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        data["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return Update.de_json({"update_id": message_id, "message": data}, application.bot)
+
+
+async def handle(application: Application, update: Update) -> None:
+    await application.process_update(update)
+    await application.update_persistence()
+
+
+@pytest.fixture(autouse=True)
+def _offline_bot(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def get_me(self: ExtBot, *_args: object, **_kwargs: object) -> User:
+        self._bot_user = User(1, "Bot", is_bot=True, username="test_bot")
+        return self._bot_user
+
+    monkeypatch.setattr(ExtBot, "get_me", get_me)
+
+
+def test_conversation_continues_on_another_application() -> None:
+    async def scenario() -> None:
+        server = FakeServer()
+        first, second = create_application(server), create_application(server)
+        async with first, second:
+            await handle(first, message(first, 1, "/start"))
+            await handle(second, message(second, 2, "Paris"))
+            assert second.bot_data["answers"] == 1
+            assert second.user_data[USER_ID] == {"asked": True, "answer": "Paris"}
+
+            # The conversation has ended on the second application.
+            await handle(first, message(first, 3, "London"))
+            assert first.bot_data["answers"] == 0
+            assert first.user_data[USER_ID] == {"asked": True, "answer": "Paris"}
+
+    asyncio.run(scenario())